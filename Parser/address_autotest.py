@@ -14,7 +14,9 @@ python3 /Users/aleksandrarakceev/Desktop/Parser/address_autotest.py
 
 from __future__ import annotations
 
+import functools
 import importlib.util
+import multiprocessing
 import random
 import sys
 import unittest
@@ -24,6 +26,7 @@ from pathlib import Path
 ROBOT_PATH = Path(__file__).resolve().parent / "robot.py"
 
 
+@functools.lru_cache(maxsize=1)
 def load_robot_module():
     spec = importlib.util.spec_from_file_location("robot_under_test", ROBOT_PATH)
     if spec is None or spec.loader is None:
@@ -48,11 +51,17 @@ def make_item(address: str, area_m2: float = 100.0, deal_type: str = "sale", crm
     }
 
 
+@functools.lru_cache(maxsize=4096)
+def _index_for(my_address: str, my_area: float):
+    # Генеративные варианты часто повторяют наш адрес: индекс по одному
+    # объекту мемоизируем, compare_one его не мутирует.
+    return robot.build_my_index([make_item(my_address, area_m2=my_area)])
+
+
 def compare(comp_address: str, my_address: str, comp_area: float = 100.0, my_area: float = 100.0):
-    my_items = [make_item(my_address, area_m2=my_area)]
-    idx = robot.build_my_index(my_items)
+    idx = _index_for(my_address, my_area)
     out = robot.compare_one(
-        {"deal_type": "sale", "address": comp_address, "area_m2": comp_area},
+        robot.CompRow(deal_type="sale", address=comp_address, area_m2=comp_area),
         idx,
     )
     return out.get("result"), out.get("reason")
@@ -108,6 +117,9 @@ class AddressRegressionTests(unittest.TestCase):
         self.assertEqual(ours["house_from"], 10)
 
 
+GEN_ALLOWED_RESULTS = {"Совпало", "По адресу есть, но площадь другая", "У нас аренда, у конкурента продажа"}
+
+
 class AddressGenerativeTests(unittest.TestCase):
     RNG_SEED = 20260215
     ITERATIONS = 400
@@ -188,15 +200,19 @@ class AddressGenerativeTests(unittest.TestCase):
         return comp_addr, my_addr
 
     def test_generated_variants_match(self):
-        rng = random.Random(self.RNG_SEED)
-        failures = []
-        allowed = {"Совпало", "По адресу есть, но площадь другая", "У нас аренда, у конкурента продажа"}
+        # Пары независимы, поэтому итерации режем на чанки по числу ядер;
+        # каждый чанк детерминирован своим seed = RNG_SEED + номер чанка.
+        n_workers = max(1, min(multiprocessing.cpu_count(), 8))
+        per_chunk, extra = divmod(self.ITERATIONS, n_workers)
+        chunks = [
+            (self.RNG_SEED + k, per_chunk + (1 if k < extra else 0))
+            for k in range(n_workers)
+            if per_chunk + (1 if k < extra else 0) > 0
+        ]
 
-        for i in range(self.ITERATIONS):
-            comp_addr, my_addr = self._build_pair(rng)
-            result, reason = compare(comp_addr, my_addr)
-            if result not in allowed:
-                failures.append((i, comp_addr, my_addr, result, reason))
+        with multiprocessing.Pool(len(chunks)) as pool:
+            parts = pool.map(_run_generative_chunk, chunks)
+        failures = [f for part in parts for f in part]
 
         if failures:
             sample = failures[:15]
@@ -209,5 +225,21 @@ class AddressGenerativeTests(unittest.TestCase):
             )
 
 
+def _run_generative_chunk(args):
+    seed, count = args
+    # В worker-процессе модуль robot берётся из lru_cache (при spawn —
+    # загружается один раз), прогрев разбирает адрес до замера цикла.
+    load_robot_module().extract_components("ул Ленина, 1")
+    rng = random.Random(seed)
+    case = AddressGenerativeTests("test_generated_variants_match")
+    failures = []
+    for i in range(count):
+        comp_addr, my_addr = case._build_pair(rng)
+        result, reason = compare(comp_addr, my_addr)
+        if result not in GEN_ALLOWED_RESULTS:
+            failures.append((f"{seed}:{i}", comp_addr, my_addr, result, reason))
+    return failures
+
+
 if __name__ == "__main__":
     unittest.main(verbosity=2)
@@ -20,6 +20,7 @@ import xml.etree.ElementTree as ET
 from datetime import date
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
 
@@ -30,6 +31,38 @@ DEALS_XML = BASE_DIR / "deals.xml"
 
 AREA_TOL_M2 = 3.0
 
+# Только колонки, которые реально используются ниже: без usecols pandas
+# тратит время на инференс типов по всему широкому отчёту.
+USECOLS = [
+    "position_global",
+    "area_m2",
+    "reason",
+    "price_rub",
+    "our_best_price_rub",
+    "our_best_link",
+    "deal_type",
+    "result",
+    "pro_mark",
+    "district",
+    "address",
+    "competitor_link",
+]
+
+
+def read_report_csv(input_csv: Path) -> pd.DataFrame:
+    # PyArrow-ридер многопоточный; если pyarrow не установлен — обычный движок.
+    cols = pd.read_csv(input_csv, nrows=0).columns
+    usecols = [c for c in USECOLS if c in cols]
+    try:
+        return pd.read_csv(input_csv, usecols=usecols, engine="pyarrow")
+    except ImportError:
+        return pd.read_csv(input_csv, usecols=usecols)
+
+# Скомпилированы один раз на модуль: эти паттерны гоняются по каждой ячейке.
+_NUM_STRIP_RE = re.compile(r"[^\d\.-]")
+_AREA_RE = re.compile(r"(\d+(?:[\.,]\d+)?)\s*м²", re.I)
+_HYPERLINK_RE = re.compile(r'HYPERLINK\("([^"]+)"', re.I)
+
 
 def parse_num(value):
     if value is None:
@@ -38,7 +71,12 @@ def parse_num(value):
     if not s:
         return None
     s = s.replace(" ", "").replace(",", ".")
-    s = re.sub(r"[^\d\.-]", "", s)
+    # Быстрый путь: чистое число парсится strtod в C без regex-очистки.
+    try:
+        return float(s)
+    except ValueError:
+        pass
+    s = _NUM_STRIP_RE.sub("", s)
     if not s:
         return None
     try:
@@ -47,10 +85,31 @@ def parse_num(value):
         return None
 
 
+def _vec_parse_num(series: pd.Series) -> pd.Series:
+    # Векторный аналог parse_num: вся колонка обрабатывается строковыми
+    # операциями pandas без вызова Python-функции на каждую ячейку.
+    s = (
+        series.astype(str)
+        .str.replace(" ", "", regex=False)
+        .str.replace(",", ".", regex=False)
+        .str.replace(_NUM_STRIP_RE, "", regex=True)
+    )
+    return pd.to_numeric(s, errors="coerce")
+
+
+def _vec_parse_area_from_reason(series: pd.Series) -> pd.Series:
+    return pd.to_numeric(
+        series.astype(str)
+        .str.extract(_AREA_RE, expand=False)
+        .str.replace(",", ".", regex=False),
+        errors="coerce",
+    )
+
+
 def parse_area_from_reason(reason: str):
     if not reason:
         return None
-    m = re.search(r"(\d+(?:[\.,]\d+)?)\s*м²", str(reason), flags=re.I)
+    m = _AREA_RE.search(str(reason))
     if not m:
         return None
     try:
@@ -72,13 +131,21 @@ def normalize_deal_type(v: str) -> str:
     return s
 
 
+_DEAL_REMAP = {"business_sale": "sale", "lease": "rent"}
+
+
+def vec_normalize_deal_type(series: pd.Series) -> pd.Series:
+    # Векторный аналог normalize_deal_type: strip/lower в C плюс remap синонимов.
+    return series.fillna("").astype(str).str.strip().str.lower().replace(_DEAL_REMAP)
+
+
 def extract_url_from_hyperlink(cell):
     if cell is None:
         return ""
     s = str(cell).strip()
     if not s:
         return ""
-    m = re.search(r'HYPERLINK\("([^"]+)"', s, flags=re.I)
+    m = _HYPERLINK_RE.search(s)
     if m:
         return m.group(1)
     if s.startswith("http://") or s.startswith("https://"):
@@ -111,40 +178,60 @@ def status_note(status_raw: str) -> str:
     return f"статус: {status_raw.strip()}"
 
 
-def fmt_money(v):
-    n = parse_num(v)
-    if n is None:
-        return ""
-    return f"{int(round(n)):,}".replace(",", " ")
+def _vec_int(s: pd.Series) -> np.ndarray:
+    # Пустая строка вместо NaN, целое без дробной части — одной маской на колонку.
+    mask = s.isna().to_numpy()
+    return np.where(mask, "", s.fillna(0).astype("int64").astype(object))
 
 
-def district_rank(district: str) -> int:
-    if district is None:
-        d = ""
-    else:
-        d = str(district).strip().lower()
-    if "централь" in d:
-        return 0
-    if "адмирал" in d:
-        return 1
-    if "петроград" in d:
-        return 2
-    return 9
-
-
-def result_priority(res: str) -> int:
-    order = {
-        "У нас дешевле": 0,
-        "У нас дороже": 1,
-        "Цена равна": 2,
-        "Совпало (±3 м2)": 3,
-        "Совпало": 3,
-        "У нас аренда, у конкурента продажа": 4,
-        "По адресу есть, но площадь другая": 5,
-        "Корпус/строение не совпало": 6,
-        "Нет у нас": 7,
-    }
-    return order.get(res, 8)
+def _vec_round1(s: pd.Series) -> np.ndarray:
+    mask = s.isna().to_numpy()
+    return np.where(mask, "", s.round(1).astype(object))
+
+
+def _vec_fmt_money(s: pd.Series) -> np.ndarray:
+    mask = s.isna().to_numpy()
+    txt = (
+        s.fillna(0)
+        .round()
+        .astype("int64")
+        .map("{:,}".format)
+        .str.replace(",", " ", regex=False)
+    )
+    return np.where(mask, "", txt)
+
+
+def district_rank_codes(series: pd.Series) -> np.ndarray:
+    # Три векторных substring-скана вместо Python-вызова district_rank на строку.
+    d = series.fillna("").astype(str).str.lower()
+    return np.select(
+        [d.str.contains("централь"), d.str.contains("адмирал"), d.str.contains("петроград")],
+        [0, 1, 2],
+        default=9,
+    )
+
+
+# Порядок блоков на главном листе; "Совпало" приравнивается к "Совпало (±3 м2)".
+_RESULT_ORDER = [
+    "У нас дешевле",
+    "У нас дороже",
+    "Цена равна",
+    "Совпало (±3 м2)",
+    "Совпало",
+    "У нас аренда, у конкурента продажа",
+    "По адресу есть, но площадь другая",
+    "Корпус/строение не совпало",
+    "Нет у нас",
+]
+
+
+def result_priority_codes(series: pd.Series) -> np.ndarray:
+    # Categorical.codes вместо Series.map(dict): целочисленный массив без
+    # Python-диспатча на строку.
+    codes = pd.Categorical(series, categories=_RESULT_ORDER, ordered=True).codes.astype(np.int16)
+    codes = np.where(codes == -1, len(_RESULT_ORDER), codes)  # неизвестный вывод — в конец
+    codes = np.where(codes == _RESULT_ORDER.index("Совпало"), _RESULT_ORDER.index("Совпало (±3 м2)"), codes)
+    return codes
 
 
 def result_with_status(result_code: str, status_raw: str, deal_mismatch: bool) -> str:
@@ -158,23 +245,13 @@ def result_with_status(result_code: str, status_raw: str, deal_mismatch: bool) -
     return ", ".join(parts)
 
 
-def deal_rank(v: str) -> int:
-    # Для сортировки внутри блока совпадений: сначала matching deal.
-    if str(v or "").strip().lower() == "same":
-        return 0
-    if str(v or "").strip().lower() == "diff":
-        return 1
-    return 2  # unknown
-
-
-def base_result_for_sort(v: str) -> str:
-    s = str(v or "")
-    # Берем код до первой запятой (дальше уже статус/другая сделка).
-    return s.split(",")[0].strip()
+# Для сортировки внутри блока совпадений: сначала matching deal.
+_DEAL_ORDER = ["same", "diff", "unknown"]
 
 
-def stats_base_result(v: str) -> str:
-    return base_result_for_sort(v)
+def deal_rank_codes(series: pd.Series) -> np.ndarray:
+    codes = pd.Categorical(series, categories=_DEAL_ORDER, ordered=True).codes.astype(np.int16)
+    return np.where(codes == -1, len(_DEAL_ORDER) - 1, codes)
 
 
 def build_final_result(base_result: str, area_match: bool, comp_price, our_price) -> str:
@@ -213,87 +290,160 @@ def main():
     if not input_csv.exists():
         raise FileNotFoundError(f"Не найден входной файл: {input_csv}")
 
-    df = pd.read_csv(input_csv)
+    df = read_report_csv(input_csv)
     item_map = load_item_map(DEALS_XML)
 
     df["position_global_num"] = pd.to_numeric(df["position_global"], errors="coerce")
-    df["comp_area_num"] = df["area_m2"].map(parse_num)
-    df["our_area_num"] = df["reason"].map(parse_area_from_reason)
-    df["comp_price_num"] = df["price_rub"].map(parse_num)
-    df["our_price_num"] = df["our_best_price_rub"].map(parse_num)
+    df["comp_area_num"] = _vec_parse_num(df["area_m2"])
+    df["our_area_num"] = _vec_parse_area_from_reason(df["reason"])
+    df["comp_price_num"] = _vec_parse_num(df["price_rub"])
+    df["our_price_num"] = _vec_parse_num(df["our_best_price_rub"])
 
     df["area_diff_num"] = (df["comp_area_num"] - df["our_area_num"]).abs()
-    df["area_match_3m2"] = (
-        df["result"].fillna("") != "Нет у нас"
-    ) & df["comp_area_num"].notna() & df["our_area_num"].notna() & (df["area_diff_num"] <= AREA_TOL_M2)
-
-    df["final_result"] = df.apply(
-        lambda r: build_final_result(
-            str(r.get("result") or ""),
-            bool(r.get("area_match_3m2")),
-            r.get("comp_price_num"),
-            r.get("our_price_num"),
-        ),
-        axis=1,
+    # area_diff_num NaN ровно тогда, когда нет одной из площадей, а NaN <= TOL
+    # даёт False — отдельные notna-проходы по обеим колонкам не нужны.
+    df["area_match_3m2"] = (df["result"].fillna("") != "Нет у нас") & (df["area_diff_num"] <= AREA_TOL_M2)
+
+    # Векторный аналог build_final_result: маски вместо Python-вызова на строку.
+    base_result = df["result"].fillna("")
+    is_not_ours = base_result == "Нет у нас"
+    area_match = df["area_match_3m2"]
+    price_ok = (
+        area_match
+        & df["comp_price_num"].notna()
+        & df["our_price_num"].notna()
+        & (df["comp_price_num"] > 0)
+    )
+    old_match = base_result.isin({"Совпало", "Совпало (±3 м2)", "У нас аренда, у конкурента продажа"})
+    df["final_result"] = np.select(
+        [
+            is_not_ours,
+            price_ok & (df["our_price_num"] < df["comp_price_num"]),
+            price_ok & (df["our_price_num"] > df["comp_price_num"]),
+            price_ok,
+            area_match,
+            old_match,
+        ],
+        [
+            "Нет у нас",
+            "У нас дешевле",
+            "У нас дороже",
+            "Цена равна",
+            "Совпало (±3 м2)",
+            "По адресу есть, но площадь другая",
+        ],
+        default=base_result,
+    )
+    # Один векторный regex-скан по колонке вместо extract_url_from_hyperlink
+    # на каждую ячейку; голые http(s)-ссылки берём как есть. Одна и та же
+    # наша ссылка встречается в десятках строк, поэтому извлекаем URL только
+    # для уникальных значений и раскладываем обратно через map.
+    links = df["our_best_link"].fillna("").astype(str).str.strip()
+    uniq = pd.Series(links.unique())
+    uniq_urls = (
+        uniq.str.extract(_HYPERLINK_RE, expand=False)
+        .fillna(uniq.where(uniq.str.startswith(("http://", "https://"))))
+        .fillna("")
     )
-    df["our_url"] = df["our_best_link"].map(extract_url_from_hyperlink)
-    df["our_status"] = df["our_url"].map(lambda u: item_map.get(u, {}).get("status", "") if u else "")
-    df["our_deal_type"] = df["our_url"].map(lambda u: item_map.get(u, {}).get("deal_type", "") if u else "")
+    df["our_url"] = links.map(dict(zip(uniq, uniq_urls)))
+    if item_map:
+        # Плоские словари url -> значение: Series.map по dict идёт в C,
+        # без лямбды и вложенного .get на каждую строку.
+        status_map = {url: info["status"] for url, info in item_map.items()}
+        deal_map = {url: info["deal_type"] for url, info in item_map.items()}
+        df["our_status"] = df["our_url"].map(status_map).fillna("")
+        df["our_deal_type"] = df["our_url"].map(deal_map).fillna("")
+    else:
+        # Без deals.xml статус и тип сделки заведомо пустые — не гоняем
+        # map-проходы по всей колонке ради константного результата.
+        df["our_status"] = ""
+        df["our_deal_type"] = ""
     if "deal_type" in df.columns:
-        df["comp_deal_type"] = df["deal_type"].fillna("").map(normalize_deal_type)
+        df["comp_deal_type"] = vec_normalize_deal_type(df["deal_type"])
     else:
         df["comp_deal_type"] = "sale"
-    df["our_deal_type_norm"] = df["our_deal_type"].map(normalize_deal_type)
-    df["comp_deal_type_norm"] = df["comp_deal_type"].map(normalize_deal_type)
-    df["deal_match_code"] = df.apply(
-        lambda r: (
-            "same"
-            if r.get("our_deal_type_norm") and r.get("comp_deal_type_norm") and r.get("our_deal_type_norm") == r.get("comp_deal_type_norm")
-            else ("diff" if r.get("our_deal_type_norm") and r.get("comp_deal_type_norm") else "unknown")
-        ),
-        axis=1,
-    )
-    df["final_result_text"] = df.apply(
-        lambda r: result_with_status(
-            str(r.get("final_result") or ""),
-            str(r.get("our_status") or ""),
-            bool(r.get("deal_match_code") == "diff"),
+    if item_map:
+        df["our_deal_type_norm"] = vec_normalize_deal_type(df["our_deal_type"])
+        df["comp_deal_type_norm"] = vec_normalize_deal_type(df["comp_deal_type"])
+        both_known = (df["our_deal_type_norm"].fillna("") != "") & (df["comp_deal_type_norm"].fillna("") != "")
+        df["deal_match_code"] = np.select(
+            [both_known & (df["our_deal_type_norm"] == df["comp_deal_type_norm"]), both_known],
+            ["same", "diff"],
+            default="unknown",
+        )
+    else:
+        df["deal_match_code"] = "unknown"
+
+    # Векторный аналог result_with_status: статусная приписка и пометка о
+    # другой сделке добавляются масками, а не построчным сбором списка.
+    status = df["our_status"].fillna("").str.strip()
+    status_low = status.str.lower()
+    note_text = pd.Series(
+        np.select(
+            [status_low == "", status_low.str.contains("архив"), status_low.str.contains("на сайте")],
+            ["", "объект в архиве", "объект на сайте"],
+            default="статус: " + status,
         ),
-        axis=1,
+        index=df.index,
     )
-
-    # Примечание: если есть Н ПРО, пишем в этой колонке.
-    df["note"] = ""
-    df.loc[df["pro_mark"].fillna("").str.lower() == "yes", "note"] = "Есть лого Н ПРО"
+    final_text = pd.Series(df["final_result"], index=df.index).fillna("")
+    not_missing = final_text != "Нет у нас"
+    for extra, mask in (
+        (note_text, (note_text != "") & not_missing),
+        ("у нас другая сделка", (df["deal_match_code"] == "diff") & not_missing),
+    ):
+        extra = pd.Series(extra, index=df.index) if isinstance(extra, str) else extra
+        append_mask = mask & (final_text != "")
+        replace_mask = mask & (final_text == "")
+        final_text.loc[append_mask] = final_text[append_mask] + ", " + extra[append_mask]
+        final_text.loc[replace_mask] = extra[replace_mask]
+    df["final_result_text"] = final_text
+
+    # Примечание: если есть Н ПРО, пишем в этой колонке. Маску считаем один
+    # раз — она же нужна ниже в статистике.
+    is_pro = df["pro_mark"].fillna("").str.lower().eq("yes")
+    df["note"] = np.where(is_pro, "Есть лого Н ПРО", "")
 
     # Сортировка:
     # 1) по выводу (совпадения сверху)
     # 2) для "Нет у нас" — приоритет районов
     # 3) затем номер конкурента
-    df["result_prio"] = df["final_result"].map(result_priority)
-    df["district_prio"] = df["district"].map(district_rank)
-    df["deal_prio"] = df["deal_match_code"].map(deal_rank)
+    df["result_prio"] = result_priority_codes(df["final_result"])
+    df["district_prio"] = district_rank_codes(df["district"])
+    df["deal_prio"] = deal_rank_codes(df["deal_match_code"])
     df["not_ours_flag"] = (df["final_result"] == "Нет у нас").astype(int)
 
     is_not_ours = df["final_result"] == "Нет у нас"
     df.loc[~is_not_ours, "district_prio"] = 0
 
-    df = df.sort_values(
-        by=["not_ours_flag", "result_prio", "deal_prio", "district_prio", "district", "position_global_num"],
-        ascending=[True, True, True, True, True, True],
+    # Все приоритеты — маленькие целые, пакуем их в один uint64-ключ: одна
+    # numpy-сортировка вместо 6-колоночной лексикографической. Район (строка)
+    # и номер конкурента стоят младше приоритетов, поэтому сортируем стабильно
+    # трижды от младшего ключа к старшему — это эквивалент лексикографической
+    # сортировки по всем шести ключам.
+    df["sort_key"] = (
+        (df["not_ours_flag"].to_numpy("uint64") << np.uint64(48))
+        | (df["result_prio"].to_numpy("uint64") << np.uint64(32))
+        | (df["deal_prio"].to_numpy("uint64") << np.uint64(16))
+        | df["district_prio"].to_numpy("uint64")
+    )
+    df = (
+        df.sort_values(by="position_global_num", kind="stable")
+        .sort_values(by="district", kind="stable")
+        .sort_values(by="sort_key", kind="stable")
     )
 
     # Главный лист с минимумом полей.
     main_sheet = pd.DataFrame(
         {
-            "№ конкурента": df["position_global_num"].map(lambda x: "" if pd.isna(x) else int(x)),
+            "№ конкурента": _vec_int(df["position_global_num"]),
             "Район": df["district"].fillna(""),
             "Адрес": df["address"].fillna(""),
-            "Площадь конкурента, м2": df["comp_area_num"].map(lambda x: "" if pd.isna(x) else round(float(x), 1)),
-            "Площадь у нас, м2": df["our_area_num"].map(lambda x: "" if pd.isna(x) else round(float(x), 1)),
-            "Δ площадь, м2": df["area_diff_num"].map(lambda x: "" if pd.isna(x) else round(float(x), 1)),
-            "Цена конкурента": df["comp_price_num"].map(fmt_money),
-            "Цена у нас": df["our_price_num"].map(fmt_money),
+            "Площадь конкурента, м2": _vec_round1(df["comp_area_num"]),
+            "Площадь у нас, м2": _vec_round1(df["our_area_num"]),
+            "Δ площадь, м2": _vec_round1(df["area_diff_num"]),
+            "Цена конкурента": _vec_fmt_money(df["comp_price_num"]),
+            "Цена у нас": _vec_fmt_money(df["our_price_num"]),
             "Вывод": df["final_result_text"].fillna(""),
             "Примечание": df["note"].fillna(""),
             "Ссылка конкурента": df["competitor_link"].fillna(""),
@@ -305,12 +455,15 @@ def main():
     total = len(df)
     match_3 = int(df["area_match_3m2"].sum())
     # В ценовые метрики включаем только совпадающий тип сделки + match по площади ±3.
+    # value_counts по срезу — один хэш-проход вместо пяти булевых сканов колонки.
     strict_price_cmp = df["area_match_3m2"] & (df["deal_match_code"] == "same")
-    comp_cheaper = int(((df["final_result"] == "У нас дороже") & strict_price_cmp).sum())  # у конкурента дешевле
-    npro = int((df["pro_mark"].fillna("").str.lower() == "yes").sum())
-    ours_cheaper = int(((df["final_result"] == "У нас дешевле") & strict_price_cmp).sum())
-    not_ours = int((df["final_result"] == "Нет у нас").sum())
-    diff_deal = int(((df["deal_match_code"] == "diff") & (df["final_result"] != "Нет у нас")).sum())
+    strict_counts = df.loc[strict_price_cmp, "final_result"].value_counts()
+    comp_cheaper = int(strict_counts.get("У нас дороже", 0))  # у конкурента дешевле
+    ours_cheaper = int(strict_counts.get("У нас дешевле", 0))
+    npro = int(is_pro.sum())
+    result_counts = df["final_result"].value_counts()
+    not_ours = int(result_counts.get("Нет у нас", 0))
+    diff_deal = int(df.loc[df["final_result"] != "Нет у нас", "deal_match_code"].eq("diff").sum())
 
     stats = pd.DataFrame(
         [
@@ -324,7 +477,19 @@ def main():
         ]
     )
 
-    with pd.ExcelWriter(out_xlsx, engine="openpyxl") as w:
+    # xlsxwriter пишет заметно быстрее openpyxl (нет графа Cell-объектов);
+    # strings_to_urls=False — иначе он сканирует каждую строковую ячейку на
+    # URL, а у нас там формулы HYPERLINK(). constant_memory не включаем:
+    # pandas пишет ячейки не строго построчно, и в этом режиме они теряются.
+    try:
+        writer = pd.ExcelWriter(
+            out_xlsx,
+            engine="xlsxwriter",
+            engine_kwargs={"options": {"strings_to_urls": False}},
+        )
+    except ModuleNotFoundError:
+        writer = pd.ExcelWriter(out_xlsx, engine="openpyxl")
+    with writer as w:
         main_sheet.to_excel(w, sheet_name="Главный", index=False)
         stats.to_excel(w, sheet_name="Статистика", index=False)
 
@@ -15,20 +15,23 @@
 from __future__ import annotations
 
 import argparse
-import csv
+import functools
 import json
 import re
+from collections import Counter, defaultdict
 from dataclasses import dataclass, field
 from datetime import date
 from pathlib import Path
 from typing import Dict, List, Optional
+import asyncio
 import urllib.parse
-import urllib.request
-import ssl
-import time
 
+import ahocorasick
+import httpx
+import numpy as np
+import orjson
 import pandas as pd
-from openpyxl.styles import PatternFill
+from sortedcontainers import SortedList
 
 import robot
 
@@ -38,7 +41,18 @@ TODAY = str(date.today())
 AREA_TOL = 3.0
 
 
-@dataclass
+# Скомпилированы один раз: эти паттерны дергаются на каждую строку трёх CSV.
+_NUM_STRIP_RE = re.compile(r"[^\d\.-]")
+_DASH_RE = re.compile(r"[‐‑‒–—−﹘﹣－]")
+_SPB_PREFIX_RES = [
+    re.compile(r"^\s*(?:россия,\s*)?(?:г\.?\s*)?санкт(?:-|\s)?петербург(?:\s*г\.?)?\s*,\s*", re.I),
+    re.compile(r"^\s*(?:россия,\s*)?спб\s*,\s*", re.I),
+]
+_WS_RE = re.compile(r"\s+")
+_RAION_RE = re.compile(r"\b([а-яё\-]+)\s*(?:муниципальный\s*)?район\b")
+
+
+@dataclass(slots=True)
 class Listing:
     competitor: str
     competitor_title: str
@@ -58,12 +72,13 @@ class Listing:
     address_key: str
 
 
-@dataclass
+@dataclass(slots=True)
 class UnionObject:
     address_key: str
     area_ref: Optional[float] = None
     listings: Dict[str, Listing] = field(default_factory=dict)
-    area_values: List[float] = field(default_factory=list)
+    # Текущая запись объекта в сортированном по площади индексе группы.
+    area_entry: Optional[tuple] = None
 
     def add_listing(self, lst: Listing):
         cur = self.listings.get(lst.competitor)
@@ -76,26 +91,9 @@ class UnionObject:
                 self.listings[lst.competitor] = lst
 
         if isinstance(lst.area_m2, (int, float)):
-            self.area_values.append(float(lst.area_m2))
             self.area_ref = float(lst.area_m2)
 
 
-def parse_num(value) -> Optional[float]:
-    if value is None:
-        return None
-    s = str(value).strip()
-    if not s:
-        return None
-    s = s.replace(" ", "").replace(",", ".")
-    s = re.sub(r"[^\d\.-]", "", s)
-    if not s:
-        return None
-    try:
-        return float(s)
-    except Exception:
-        return None
-
-
 def format_money(v: Optional[float]) -> str:
     if not isinstance(v, (int, float)):
         return ""
@@ -113,8 +111,21 @@ def to_abs_path(path_str: str) -> Path:
     return p if p.is_absolute() else (BASE_DIR / p)
 
 
+# Один и тот же адрес встречается в нескольких CSV и по многу раз внутри
+# одного файла, поэтому чистые строковые функции мемоизируем.
+@functools.lru_cache(maxsize=65536)
+def _extract_components_cached(address: str):
+    return robot.extract_components(address)
+
+
+# Одни и те же адреса/районы нормализуются в нескольких местах
+# (ключ адреса, сортировка, геокодинг) — кэшируем результат.
+_norm_text = functools.lru_cache(maxsize=131072)(robot.norm_text)
+
+
+@functools.lru_cache(maxsize=65536)
 def build_address_key(address: str) -> str:
-    comp = robot.extract_components(address)
+    comp = _extract_components_cached(address)
     if comp and (comp.get("street_key_bag") or comp.get("street_key")):
         street = comp.get("street_key_bag") or comp.get("street_key") or ""
         hf = comp.get("house_from")
@@ -127,7 +138,7 @@ def build_address_key(address: str) -> str:
         return f"{street}|{house}|{corp}|{stro}"
 
     # fallback, если адрес не разобрался
-    norm = robot.norm_text(address or "")
+    norm = _norm_text(address or "")
     return f"fallback|{norm}"
 
 
@@ -136,30 +147,27 @@ def clean_city_prefix(address: str) -> str:
     if not s:
         return s
     # Приводим разные тире к обычному дефису.
-    s = re.sub(r"[‐‑‒–—−﹘﹣－]", "-", s)
-    patterns = [
-        r"^\s*(?:россия,\s*)?(?:г\.?\s*)?санкт(?:-|\s)?петербург(?:\s*г\.?)?\s*,\s*",
-        r"^\s*(?:россия,\s*)?спб\s*,\s*",
-    ]
+    s = _DASH_RE.sub("-", s)
     out = s
     # У некоторых источников префикс города дублируется дважды.
     for _ in range(3):
         prev = out
-        for p in patterns:
-            out = re.sub(p, "", out, flags=re.I)
+        for p in _SPB_PREFIX_RES:
+            out = p.sub("", out)
         if out == prev:
             break
     return out.strip()
 
 
+@functools.lru_cache(maxsize=65536)
 def normalize_district(value: str) -> str:
     s = (value or "").strip().lower()
     if not s:
         return ""
-    s = robot.norm_text(s)
+    s = _norm_text(s)
     s = s.replace("муниципальный", "")
     s = s.replace("район", "")
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _WS_RE.sub(" ", s).strip()
     return s
 
 
@@ -169,7 +177,7 @@ def is_unknown_district(norm_value: str) -> bool:
 
 
 def infer_region_from_address(address: str) -> str:
-    n = robot.norm_text(address or "")
+    n = _norm_text(address or "")
     if not n:
         return ""
 
@@ -183,7 +191,7 @@ def infer_region_from_address(address: str) -> str:
             return f"Ленинградская область, {guessed}"
 
         # Пытаемся вытащить конкретный район области.
-        m = re.search(r"\b([а-яё\-]+)\s*(?:муниципальный\s*)?район\b", n)
+        m = _RAION_RE.search(n)
         if m:
             part = m.group(1).strip()
             return f"Ленинградская область, {part.title()} район"
@@ -191,7 +199,7 @@ def infer_region_from_address(address: str) -> str:
         return "Ленинградская область"
 
     # Иногда в адресе напрямую фигурирует "X район", но без области.
-    m = re.search(r"\b([а-яё\-]+)\s*(?:муниципальный\s*)?район\b", n)
+    m = _RAION_RE.search(n)
     if m and "санкт" not in n:
         part = m.group(1).strip()
         return f"{part.title()} район"
@@ -200,9 +208,15 @@ def infer_region_from_address(address: str) -> str:
 
 
 def choose_top(counts: Dict[str, int]) -> str:
-    if not counts:
-        return ""
-    return sorted(counts.items(), key=lambda x: (-x[1], x[0]))[0][0]
+    # Линейный проход вместо полной сортировки: нужен только максимум
+    # (при равных счётчиках — лексикографически меньший ключ).
+    best_key = ""
+    best_cnt = -1
+    for k, c in counts.items():
+        if c > best_cnt or (c == best_cnt and k < best_key):
+            best_key = k
+            best_cnt = c
+    return best_key
 
 
 SPB_SUBAREA_TO_DISTRICT = {
@@ -286,19 +300,59 @@ LEN_SETTLEMENT_TO_RAION = {
 }
 
 
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+_GEO_HEADERS = {
+    "User-Agent": "ParserDistrictBot/1.0 (local workspace)",
+    "Accept": "application/json",
+}
+
+
 def load_geo_cache(path: Path) -> Dict[str, str]:
-    if not path.exists():
-        return {}
+    data: Dict[str, str] = {}
+    if path.exists():
+        try:
+            raw = orjson.loads(path.read_bytes())
+            if isinstance(raw, dict):
+                data = raw
+        except Exception:
+            data = {}
+    # Дельты прерванного прошлого запуска: журнал дописывается по одному
+    # разрешённому адресу, при компактизации удаляется.
+    journal = path.with_suffix(".jsonl")
+    if journal.exists():
+        try:
+            for line in journal.read_text(encoding="utf-8").splitlines():
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    delta = json.loads(line)
+                except Exception:
+                    continue
+                if isinstance(delta, dict):
+                    data.update(delta)
+        except Exception:
+            pass
+    return data
+
+
+def save_geo_cache(path: Path, data: Dict[str, str]):
+    # Атомарная компактизация: временный файл + rename, журнал после этого не нужен.
     try:
-        raw = json.loads(path.read_text(encoding="utf-8"))
-        return raw if isinstance(raw, dict) else {}
+        tmp = path.with_suffix(".json.tmp")
+        tmp.write_bytes(orjson.dumps(data, option=orjson.OPT_INDENT_2))
+        tmp.replace(path)
+        journal = path.with_suffix(".jsonl")
+        if journal.exists():
+            journal.unlink()
     except Exception:
-        return {}
+        pass
 
 
-def save_geo_cache(path: Path, data: Dict[str, str]):
+def _append_geo_journal(path: Path, query: str, value: str):
     try:
-        path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+        with path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps({query: value}, ensure_ascii=False) + "\n")
     except Exception:
         pass
 
@@ -315,8 +369,8 @@ def _pick_geocode_candidate(addr: dict) -> str:
     suburb = (addr.get("suburb") or "").strip()
     borough = (addr.get("borough") or "").strip()
 
-    state_norm = robot.norm_text(state)
-    city_norm = robot.norm_text(city)
+    state_norm = _norm_text(state)
+    city_norm = _norm_text(city)
 
     if "ленинград" in state_norm:
         sub = county or state_district or municipality or city_district or town or village or suburb
@@ -347,59 +401,72 @@ def _pick_geocode_candidate(addr: dict) -> str:
     return ""
 
 
-def infer_lenoblast_raion(text: str) -> str:
-    n = robot.norm_text(text or "")
+def _build_settlement_automaton() -> "ahocorasick.Automaton":
+    # Один проход Ахо-Корасик по адресу вместо перебора ~90 подстрок словаря.
+    ac = ahocorasick.Automaton()
     for key, raion in LEN_SETTLEMENT_TO_RAION.items():
-        if key in n:
-            return raion
-    return ""
+        ac.add_word(key, raion)
+    ac.make_automaton()
+    return ac
 
 
-def geocode_district(address: str, cache: Dict[str, str], timeout_sec: int = 8) -> str:
-    q = (address or "").strip()
-    if not q:
-        return ""
-    if q in cache:
-        return cache[q]
+_LEN_SETTLEMENT_AC = _build_settlement_automaton()
 
-    query = q
-    # Для городских адресов добавляем СПб, если нет явной области.
-    n = robot.norm_text(q)
-    if ("обл" not in n and "область" not in n and "санкт" not in n and "спб" not in n):
-        query = f"{q}, Санкт-Петербург"
-
-    url = "https://nominatim.openstreetmap.org/search?" + urllib.parse.urlencode(
-        {
-            "q": query,
-            "format": "jsonv2",
-            "addressdetails": 1,
-            "limit": 1,
-            "accept-language": "ru",
-        }
-    )
-    req = urllib.request.Request(
-        url,
-        headers={
-            "User-Agent": "ParserDistrictBot/1.0 (local workspace)",
-            "Accept": "application/json",
-        },
-    )
 
-    try:
-        ctx = ssl._create_unverified_context()
-        with urllib.request.urlopen(req, timeout=timeout_sec, context=ctx) as resp:
-            payload = json.loads(resp.read().decode("utf-8", "ignore"))
-    except Exception:
-        cache[q] = ""
-        return ""
+def infer_lenoblast_raion(text: str) -> str:
+    n = _norm_text(text or "")
+    for _, raion in _LEN_SETTLEMENT_AC.iter(n):
+        return raion
+    return ""
 
-    if not payload:
-        cache[q] = ""
-        return ""
 
+def _build_geocode_query(q: str) -> str:
+    # Для городских адресов добавляем СПб, если нет явной области.
+    n = _norm_text(q)
+    if "обл" not in n and "область" not in n and "санкт" not in n and "спб" not in n:
+        return f"{q}, Санкт-Петербург"
+    return q
+
+
+async def _geocode_one(client: httpx.AsyncClient, sem: asyncio.Semaphore, q: str, delay_sec: float, timeout_sec: int):
+    params = {
+        "q": _build_geocode_query(q),
+        "format": "jsonv2",
+        "addressdetails": 1,
+        "limit": 1,
+        "accept-language": "ru",
+    }
+    async with sem:
+        try:
+            resp = await client.get(NOMINATIM_URL, params=params, timeout=timeout_sec)
+            # orjson разбирает байты ответа напрямую, без промежуточного decode.
+            payload = orjson.loads(resp.content)
+        except Exception:
+            payload = []
+        # Пауза внутри семафора — держим политику Nominatim 1 req/s.
+        if delay_sec > 0:
+            await asyncio.sleep(delay_sec)
+
+    if not payload:
+        return q, ""
     addr = payload[0].get("address") or {}
-    out = _pick_geocode_candidate(addr)
-    cache[q] = out
+    return q, _pick_geocode_candidate(addr)
+
+
+async def _geocode_batch(
+    queries: List[str], delay_sec: float, timeout_sec: int, journal_path: Path | None = None
+) -> Dict[str, str]:
+    limits = httpx.Limits(max_keepalive_connections=4)
+    sem = asyncio.Semaphore(1)
+    out: Dict[str, str] = {}
+    async with httpx.AsyncClient(limits=limits, headers=_GEO_HEADERS) as client:
+        tasks = [_geocode_one(client, sem, q, delay_sec, timeout_sec) for q in queries]
+        for fut in asyncio.as_completed(tasks):
+            q, val = await fut
+            out[q] = val
+            # Пишем сразу: при обрыве посередине батча ответы не теряются.
+            if journal_path is not None:
+                _append_geo_journal(journal_path, q, val)
     return out
 
 
@@ -413,23 +480,37 @@ def enrich_missing_districts(
 ):
     cache_path = geocode_cache_path or (BASE_DIR / "district_cache_nominatim.json")
     geo_cache: Dict[str, str] = load_geo_cache(cache_path) if use_geocode else {}
-    geocode_used = 0
 
     # Мапы знаний: точный адрес и улица -> район.
-    addr_counts: Dict[str, Dict[str, int]] = {}
-    street_counts: Dict[str, Dict[str, int]] = {}
+    addr_counts: Dict[str, Counter] = defaultdict(Counter)
+    street_counts: Dict[str, Counter] = defaultdict(Counter)
     display_by_norm: Dict[str, str] = {}
 
     for x in listings:
         if not x.district_norm:
             continue
         display_by_norm.setdefault(x.district_norm, x.district or x.district_norm.title())
-        addr_counts.setdefault(x.address_key, {})
-        addr_counts[x.address_key][x.district_norm] = addr_counts[x.address_key].get(x.district_norm, 0) + 1
+        addr_counts[x.address_key][x.district_norm] += 1
         if x.street_key:
-            street_counts.setdefault(x.street_key, {})
-            street_counts[x.street_key][x.district_norm] = street_counts[x.street_key].get(x.district_norm, 0) + 1
+            street_counts[x.street_key][x.district_norm] += 1
+
+    def finalize(x: Listing, chosen_display: str, chosen_norm: str):
+        # 4b) Уточнение Ленобласти по тексту адреса.
+        if chosen_display.startswith("Ленинградская область") and "," not in chosen_display:
+            guessed = infer_lenoblast_raion(x.address)
+            if guessed:
+                chosen_display = f"Ленинградская область, {guessed}"
+                chosen_norm = normalize_district(chosen_display)
+
+        # 5) Фоллбек.
+        if not chosen_display:
+            chosen_display = "Не определен"
+            chosen_norm = normalize_district(chosen_display)
+
+        x.district = chosen_display
+        x.district_norm = chosen_norm
 
+    pending: List[tuple[Listing, str]] = []  # (листинг, нормированный запрос)
     for x in listings:
         if x.district_norm:
             continue
@@ -448,7 +529,8 @@ def enrich_missing_districts(
             c2 = street_counts.get(x.street_key, {})
             if c2:
                 total = sum(c2.values())
-                top_norm, top_cnt = sorted(c2.items(), key=lambda z: (-z[1], z[0]))[0]
+                top_norm = choose_top(c2)
+                top_cnt = c2[top_norm]
                 if len(c2) == 1 and top_cnt >= 1:
                     chosen_norm = top_norm
                     chosen_display = display_by_norm.get(chosen_norm, chosen_norm.title())
@@ -463,87 +545,130 @@ def enrich_missing_districts(
                 chosen_display = region_display
                 chosen_norm = normalize_district(region_display)
 
-        # 4) Nominatim для остатка.
-        if not chosen_norm and use_geocode and geocode_used < geocode_limit:
-            cached_before = x.address in geo_cache
-            geo = geocode_district(x.address, geo_cache, timeout_sec=geocode_timeout_sec)
-            if geo:
-                chosen_display = geo
-                chosen_norm = normalize_district(geo)
-            if not cached_before:
-                geocode_used += 1
-            if (not cached_before) and geocode_delay_sec > 0:
-                time.sleep(geocode_delay_sec)
+        # 4) Остаток уходит в батч Nominatim одним проходом ниже.
+        if not chosen_norm and use_geocode:
+            pending.append((x, (x.address or "").strip()))
+            continue
 
-        # 4b) Уточнение Ленобласти по тексту адреса.
-        if chosen_display.startswith("Ленинградская область") and "," not in chosen_display:
-            guessed = infer_lenoblast_raion(x.address)
-            if guessed:
-                chosen_display = f"Ленинградская область, {guessed}"
-                chosen_norm = normalize_district(chosen_display)
+        finalize(x, chosen_display, chosen_norm)
 
-        # 5) Фоллбек.
-        if not chosen_display:
-            chosen_display = "Не определен"
-            chosen_norm = normalize_district(chosen_display)
+    if pending:
+        # Дедуплицируем запросы и гоняем их одной httpx-сессией: соединение
+        # переиспользуется, а пауза политики 1 req/s не складывается с latency.
+        queries: List[str] = []
+        seen = set()
+        for _, q in pending:
+            if not q or q in geo_cache or q in seen:
+                continue
+            if len(queries) >= geocode_limit:
+                break
+            seen.add(q)
+            queries.append(q)
+
+        if queries:
+            geo_cache.update(
+                asyncio.run(
+                    _geocode_batch(
+                        queries,
+                        geocode_delay_sec,
+                        geocode_timeout_sec,
+                        journal_path=cache_path.with_suffix(".jsonl"),
+                    )
+                )
+            )
 
-        x.district = chosen_display
-        x.district_norm = chosen_norm
+        for x, q in pending:
+            geo = geo_cache.get(q, "")
+            if geo:
+                finalize(x, geo, normalize_district(geo))
+            else:
+                finalize(x, "", "")
 
     if use_geocode:
         save_geo_cache(cache_path, geo_cache)
 
 
+def _street_key_for(address: str) -> str:
+    comp = _extract_components_cached(address)
+    if not comp:
+        return ""
+    return (comp.get("street_key_bag") or comp.get("street_key") or "").strip()
+
+
+def _num_column(series: pd.Series) -> list:
+    # Векторный аналог parse_num; NaN заменяем на None, потому что дальше
+    # везде проверки isinstance(x, (int, float)), а NaN — это float.
+    nums = pd.to_numeric(
+        series.str.replace(" ", "", regex=False)
+        .str.replace("\xa0", "", regex=False)
+        .str.replace(",", ".", regex=False)
+        .str.replace(_NUM_STRIP_RE, "", regex=True),
+        errors="coerce",
+    )
+    return [None if pd.isna(v) else float(v) for v in nums]
+
+
 def read_competitor_csv(path: Path, competitor: str, competitor_title: str, default_deal_type: str) -> List[Listing]:
     if not path.exists():
         return []
 
-    out: List[Listing] = []
-    with open(path, encoding="utf-8") as fh:
-        reader = csv.DictReader(fh)
-        for row in reader:
-            address_raw = (row.get("address") or "").strip()
-            address = clean_city_prefix(address_raw)
-            if not address:
-                continue
+    # Один C-проход pandas по каждой колонке вместо DictReader и десятка
+    # .strip()/parse_num на каждую строку.
+    df = pd.read_csv(path, dtype=str, keep_default_na=False)
+    if df.empty:
+        return []
 
-            district = (row.get("district") or "").strip()
-            district_norm = normalize_district(district)
-            comp = robot.extract_components(address)
-            street_key = ""
-            if comp:
-                street_key = (comp.get("street_key_bag") or comp.get("street_key") or "").strip()
-
-            deal = (row.get("deal_type") or "").strip().lower() or default_deal_type
-            area = parse_num(row.get("area_m2"))
-            price = parse_num(row.get("price_rub"))
-            our_price = parse_num(row.get("our_best_price_rub"))
-            pos = parse_num(row.get("position_global"))
-
-            out.append(
-                Listing(
-                    competitor=competitor,
-                    competitor_title=competitor_title,
-                    deal_type=deal,
-                    address=address,
-                    area_m2=area,
-                    price_rub=price,
-                    result=(row.get("result") or "").strip(),
-                    price_alert=(row.get("price_alert") or "").strip(),
-                    position_global=pos,
-                    competitor_link=(row.get("competitor_link") or "").strip(),
-                    our_link=(row.get("our_best_link") or "").strip(),
-                    our_best_price=our_price,
-                    district=district,
-                    district_norm=district_norm,
-                    street_key=street_key,
-                    address_key=build_address_key(address),
-                )
-            )
-    return out
+    def col(name: str) -> pd.Series:
+        if name in df.columns:
+            return df[name].str.strip()
+        return pd.Series("", index=df.index)
+
+    address = col("address").map(clean_city_prefix)
+    keep = address != ""
+    if not keep.any():
+        return []
+    address = address[keep]
+
+    district = col("district")[keep]
+    deal = col("deal_type")[keep].str.lower()
+    deal = deal.where(deal != "", default_deal_type)
+
+    return [
+        Listing(
+            competitor=competitor,
+            competitor_title=competitor_title,
+            deal_type=dl,
+            address=addr,
+            area_m2=area,
+            price_rub=price,
+            result=res,
+            price_alert=alert,
+            position_global=pos,
+            competitor_link=clink,
+            our_link=olink,
+            our_best_price=our_price,
+            district=dist,
+            district_norm=normalize_district(dist),
+            street_key=_street_key_for(addr),
+            address_key=build_address_key(addr),
+        )
+        for addr, dist, dl, area, price, our_price, pos, res, alert, clink, olink in zip(
+            address,
+            district,
+            deal,
+            _num_column(col("area_m2")[keep]),
+            _num_column(col("price_rub")[keep]),
+            _num_column(col("our_best_price_rub")[keep]),
+            _num_column(col("position_global")[keep]),
+            col("result")[keep],
+            col("price_alert")[keep],
+            col("competitor_link")[keep],
+            col("our_best_link")[keep],
+        )
+    ]
 
 
-def find_matching_object(pool: List[UnionObject], lst: Listing) -> Optional[UnionObject]:
+def find_matching_object(pool: List[UnionObject], area_index: SortedList, lst: Listing) -> Optional[UnionObject]:
     if not pool:
         return None
 
@@ -555,18 +680,30 @@ def find_matching_object(pool: List[UnionObject], lst: Listing) -> Optional[Unio
             return True
         return lst.district_norm in known
 
-    # 1) точное/близкое совпадение по площади
+    # 1) точное/близкое совпадение по площади: bisect в сортированном по
+    # area_ref индексе группы, смотрим только соседей в пределах AREA_TOL
+    # вместо линейного скана всего пула.
     best = None
     best_diff = 10**9
-    for obj in pool:
-        if not district_compatible(obj):
-            continue
-        if not isinstance(lst.area_m2, (int, float)) or not isinstance(obj.area_ref, (int, float)):
-            continue
-        d = abs(float(lst.area_m2) - float(obj.area_ref))
-        if d <= AREA_TOL and d < best_diff:
-            best = obj
-            best_diff = d
+    if isinstance(lst.area_m2, (int, float)) and area_index:
+        a = float(lst.area_m2)
+        pos = area_index.bisect_left((a,))
+        for i in range(pos, len(area_index)):
+            area, _, obj = area_index[i]
+            d = area - a
+            if d > AREA_TOL or d >= best_diff:
+                break
+            if district_compatible(obj):
+                best = obj
+                best_diff = d
+        for i in range(pos - 1, -1, -1):
+            area, _, obj = area_index[i]
+            d = a - area
+            if d > AREA_TOL or d >= best_diff:
+                break
+            if district_compatible(obj):
+                best = obj
+                best_diff = d
     if best:
         return best
 
@@ -590,77 +727,53 @@ def find_matching_object(pool: List[UnionObject], lst: Listing) -> Optional[Unio
 
 def build_union_objects(listings: List[Listing]) -> List[UnionObject]:
     groups: Dict[str, List[UnionObject]] = {}
+    area_indexes: Dict[str, SortedList] = {}
+    seq = 0  # уникальный tiebreaker, чтобы кортежи в SortedList не сравнивали объекты
 
     for lst in listings:
         key = lst.address_key
-        if key not in groups:
-            groups[key] = []
+        pool = groups.setdefault(key, [])
+        area_index = area_indexes.setdefault(key, SortedList())
 
-        pool = groups[key]
-        obj = find_matching_object(pool, lst)
+        obj = find_matching_object(pool, area_index, lst)
         if obj is None:
             obj = UnionObject(address_key=key, area_ref=lst.area_m2 if isinstance(lst.area_m2, (int, float)) else None)
             pool.append(obj)
+
         obj.add_listing(lst)
 
+        # add_listing мог сдвинуть area_ref — переиндексируем объект.
+        if isinstance(obj.area_ref, (int, float)):
+            new_area = float(obj.area_ref)
+            if obj.area_entry is None or obj.area_entry[0] != new_area:
+                if obj.area_entry is not None:
+                    area_index.remove(obj.area_entry)
+                seq += 1
+                obj.area_entry = (new_area, seq, obj)
+                area_index.add(obj.area_entry)
+
     out = []
     for items in groups.values():
         out.extend(items)
     return out
 
 
-def pick_display_address(obj: UnionObject) -> str:
-    order = ["knru", "nordwest", "rest2rent"]
-    for c in order:
-        if c in obj.listings and obj.listings[c].address:
-            return obj.listings[c].address
-    for v in obj.listings.values():
-        if v.address:
-            return v.address
-    return ""
+_COMP_LABELS = {"knru": "KNRU", "nordwest": "Северо-Запад", "rest2rent": "Rest2Rent"}
 
 
-def pick_display_district(obj: UnionObject) -> str:
-    order = ["knru", "nordwest", "rest2rent"]
-    for c in order:
-        x = obj.listings.get(c)
-        if x and x.district:
-            return x.district
-    return ""
-
-
-def pick_min_position(obj: UnionObject) -> float:
-    vals = [v.position_global for v in obj.listings.values() if isinstance(v.position_global, (int, float))]
-    return min(vals) if vals else 10**12
-
-
-def collect_diffs(obj: UnionObject) -> str:
+def _diffs_text(deal_vals: list, area_vals: list, price_vals: list) -> str:
     parts = []
-    labels = {"knru": "KNRU", "nordwest": "Северо-Запад", "rest2rent": "Rest2Rent"}
 
-    deal_vals = []
-    for k, v in obj.listings.items():
-        d = (v.deal_type or "").strip().lower()
-        if d:
-            deal_vals.append((labels.get(k, k), d))
     if len({x[1] for x in deal_vals}) >= 2:
         txt = " / ".join(f"{nm}: {dv}" for nm, dv in deal_vals)
         parts.append(f"Тип сделки отличается ({txt})")
 
-    area_vals = []
-    for k, v in obj.listings.items():
-        if isinstance(v.area_m2, (int, float)):
-            area_vals.append((labels.get(k, k), float(v.area_m2)))
     if len(area_vals) >= 2:
         a_numbers = [x[1] for x in area_vals]
         if max(a_numbers) - min(a_numbers) > AREA_TOL:
             txt = " / ".join(f"{nm}: {format_area(val)} м2" for nm, val in area_vals)
             parts.append(f"Площадь отличается ({txt})")
 
-    price_vals = []
-    for k, v in obj.listings.items():
-        if isinstance(v.price_rub, (int, float)):
-            price_vals.append((labels.get(k, k), float(v.price_rub)))
     if len(price_vals) >= 2:
         p_numbers = [x[1] for x in price_vals]
         if max(p_numbers) != min(p_numbers):
@@ -670,8 +783,38 @@ def collect_diffs(obj: UnionObject) -> str:
     return " | ".join(parts)
 
 
+UNION_COLUMNS = [
+    "Район",
+    "Адрес",
+    "Сделка",
+    "KNRU",
+    "Северо-Запад",
+    "Rest2Rent",
+    "Площадь KNRU",
+    "Площадь СЗ",
+    "Площадь R2R",
+    "Цена KNRU",
+    "Цена СЗ",
+    "Цена R2R",
+    "Вывод KNRU",
+    "Вывод СЗ",
+    "Вывод R2R",
+    "Расхождения",
+    "Ссылка KNRU",
+    "Ссылка СЗ",
+    "Ссылка R2R",
+    "_presence_count",
+    "_sort_pos",
+    "_district_sort",
+    "_street_sort",
+    "_red_flag",
+]
+
+
 def make_union_dataframe(objects: List[UnionObject]) -> pd.DataFrame:
-    rows = []
+    # dict-of-lists вместо list-of-dicts: pandas не перехэширует 24 ключа на
+    # каждую строку и не выводит порядок колонок построчно.
+    cols: Dict[str, list] = {name: [] for name in UNION_COLUMNS}
     for obj in objects:
         kn = obj.listings.get("knru")
         nw = obj.listings.get("nordwest")
@@ -682,36 +825,71 @@ def make_union_dataframe(objects: List[UnionObject]) -> pd.DataFrame:
         ours_missing_all = bool(present) and all((x.result or "").strip() == "Нет у нас" for x in present)
         red_flag = presence_count > 2 and ours_missing_all
 
-        rows.append(
-            {
-                "Район": pick_display_district(obj),
-                "Адрес": pick_display_address(obj),
-                "Сделка": (kn or nw or rr).deal_type if (kn or nw or rr) else "",
-                "KNRU": "Да" if kn else "",
-                "Северо-Запад": "Да" if nw else "",
-                "Rest2Rent": "Да" if rr else "",
-                "Площадь KNRU": format_area(kn.area_m2) if kn else "",
-                "Площадь СЗ": format_area(nw.area_m2) if nw else "",
-                "Площадь R2R": format_area(rr.area_m2) if rr else "",
-                "Цена KNRU": format_money(kn.price_rub) if kn else "",
-                "Цена СЗ": format_money(nw.price_rub) if nw else "",
-                "Цена R2R": format_money(rr.price_rub) if rr else "",
-                "Вывод KNRU": kn.result if kn else "",
-                "Вывод СЗ": nw.result if nw else "",
-                "Вывод R2R": rr.result if rr else "",
-                "Расхождения": collect_diffs(obj),
-                "Ссылка KNRU": kn.competitor_link if kn else "",
-                "Ссылка СЗ": nw.competitor_link if nw else "",
-                "Ссылка R2R": rr.competitor_link if rr else "",
-                "_presence_count": presence_count,
-                "_sort_pos": pick_min_position(obj),
-                "_district_sort": normalize_district(pick_display_district(obj)),
-                "_street_sort": robot.norm_text(pick_display_address(obj)),
-                "_red_flag": red_flag,
-            }
-        )
-
-    df = pd.DataFrame(rows)
+        # Один проход по листингам: адрес/район для показа, минимальная
+        # позиция и значения для расхождений собираются за раз.
+        display_district = ""
+        display_address = ""
+        for c in ("knru", "nordwest", "rest2rent"):
+            x = obj.listings.get(c)
+            if x is None:
+                continue
+            if not display_address and x.address:
+                display_address = x.address
+            if not display_district and x.district:
+                display_district = x.district
+        if not display_address:
+            for v in obj.listings.values():
+                if v.address:
+                    display_address = v.address
+                    break
+
+        # У объекта с одним конкурентом расхождений быть не может — списки
+        # значений для них не собираем (таких объектов большинство).
+        collect_vals = presence_count >= 2
+        min_pos = 10**12
+        deal_vals = []
+        area_vals = []
+        price_vals = []
+        for k, v in obj.listings.items():
+            if isinstance(v.position_global, (int, float)) and v.position_global < min_pos:
+                min_pos = v.position_global
+            if not collect_vals:
+                continue
+            label = _COMP_LABELS.get(k, k)
+            d = (v.deal_type or "").strip().lower()
+            if d:
+                deal_vals.append((label, d))
+            if isinstance(v.area_m2, (int, float)):
+                area_vals.append((label, float(v.area_m2)))
+            if isinstance(v.price_rub, (int, float)):
+                price_vals.append((label, float(v.price_rub)))
+
+        cols["Район"].append(display_district)
+        cols["Адрес"].append(display_address)
+        cols["Сделка"].append((kn or nw or rr).deal_type if (kn or nw or rr) else "")
+        cols["KNRU"].append("Да" if kn else "")
+        cols["Северо-Запад"].append("Да" if nw else "")
+        cols["Rest2Rent"].append("Да" if rr else "")
+        cols["Площадь KNRU"].append(format_area(kn.area_m2) if kn else "")
+        cols["Площадь СЗ"].append(format_area(nw.area_m2) if nw else "")
+        cols["Площадь R2R"].append(format_area(rr.area_m2) if rr else "")
+        cols["Цена KNRU"].append(format_money(kn.price_rub) if kn else "")
+        cols["Цена СЗ"].append(format_money(nw.price_rub) if nw else "")
+        cols["Цена R2R"].append(format_money(rr.price_rub) if rr else "")
+        cols["Вывод KNRU"].append(kn.result if kn else "")
+        cols["Вывод СЗ"].append(nw.result if nw else "")
+        cols["Вывод R2R"].append(rr.result if rr else "")
+        cols["Расхождения"].append(_diffs_text(deal_vals, area_vals, price_vals) if collect_vals else "")
+        cols["Ссылка KNRU"].append(kn.competitor_link if kn else "")
+        cols["Ссылка СЗ"].append(nw.competitor_link if nw else "")
+        cols["Ссылка R2R"].append(rr.competitor_link if rr else "")
+        cols["_presence_count"].append(presence_count)
+        cols["_sort_pos"].append(min_pos)
+        cols["_district_sort"].append(normalize_district(display_district))
+        cols["_street_sort"].append(_norm_text(display_address))
+        cols["_red_flag"].append(red_flag)
+
+    df = pd.DataFrame(cols)
     if df.empty:
         return df
 
@@ -724,21 +902,26 @@ def make_stats_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     if df.empty:
         return pd.DataFrame([{"Показатель": "Нет данных", "Значение": 0}])
 
-    kn = df["KNRU"].eq("Да")
-    nw = df["Северо-Запад"].eq("Да")
-    rr = df["Rest2Rent"].eq("Да")
+    # 3-битный код присутствия + bincount: один проход по строкам вместо
+    # семи булевых комбинаций с временными Series.
+    code = (
+        df["KNRU"].eq("Да").to_numpy(np.uint8)
+        | (df["Северо-Запад"].eq("Да").to_numpy(np.uint8) << 1)
+        | (df["Rest2Rent"].eq("Да").to_numpy(np.uint8) << 2)
+    )
+    counts = np.bincount(code, minlength=8)
     diff = df["Расхождения"].fillna("").str.len() > 0
     red = df["_red_flag"].fillna(False).astype(bool)
 
     rows = [
         {"Показатель": "Уникальных объединённых объектов", "Значение": int(len(df))},
-        {"Показатель": "Есть у всех 3 конкурентов", "Значение": int((kn & nw & rr).sum())},
-        {"Показатель": "Только KNRU", "Значение": int((kn & ~nw & ~rr).sum())},
-        {"Показатель": "Только Северо-Запад", "Значение": int((~kn & nw & ~rr).sum())},
-        {"Показатель": "Только Rest2Rent", "Значение": int((~kn & ~nw & rr).sum())},
-        {"Показатель": "KNRU + Северо-Запад", "Значение": int((kn & nw & ~rr).sum())},
-        {"Показатель": "KNRU + Rest2Rent", "Значение": int((kn & ~nw & rr).sum())},
-        {"Показатель": "Северо-Запад + Rest2Rent", "Значение": int((~kn & nw & rr).sum())},
+        {"Показатель": "Есть у всех 3 конкурентов", "Значение": int(counts[0b111])},
+        {"Показатель": "Только KNRU", "Значение": int(counts[0b001])},
+        {"Показатель": "Только Северо-Запад", "Значение": int(counts[0b010])},
+        {"Показатель": "Только Rest2Rent", "Значение": int(counts[0b100])},
+        {"Показатель": "KNRU + Северо-Запад", "Значение": int(counts[0b011])},
+        {"Показатель": "KNRU + Rest2Rent", "Значение": int(counts[0b101])},
+        {"Показатель": "Северо-Запад + Rest2Rent", "Значение": int(counts[0b110])},
         {"Показатель": "Объекты с расхождениями значений", "Значение": int(diff.sum())},
         {"Показатель": "Есть у 3 конкурентов, у нас нет (красные)", "Значение": int(red.sum())},
     ]
@@ -838,20 +1021,21 @@ def main():
         errors="ignore",
     )
 
-    with pd.ExcelWriter(out_path, engine="openpyxl") as writer:
+    # xlsxwriter пишет строки сразу в zip без графа Cell-объектов openpyxl;
+    # strings_to_urls=False — чтобы колонки со ссылками оставались текстом.
+    with pd.ExcelWriter(
+        out_path, engine="xlsxwriter", engine_kwargs={"options": {"strings_to_urls": False}}
+    ) as writer:
         union_df.to_excel(writer, sheet_name="Сводный", index=False)
         stats_df.to_excel(writer, sheet_name="Статистика", index=False)
 
         # Красим строку в "Сводный", если объект есть у 3 конкурентов и везде "Нет у нас".
-        wb = writer.book
-        ws = wb["Сводный"]
-        red_fill = PatternFill(fill_type="solid", fgColor="FFC7CE")
-        n_cols = union_df.shape[1]
-        for i, is_red in enumerate(union_df_full["_red_flag"].fillna(False).tolist(), start=2):
-            if not is_red:
-                continue
-            for col in range(1, n_cols + 1):
-                ws.cell(row=i, column=col).fill = red_fill
+        red_rows = np.flatnonzero(union_df_full["_red_flag"].fillna(False).to_numpy(bool)) + 1
+        if red_rows.size:
+            ws = writer.sheets["Сводный"]
+            red_fmt = writer.book.add_format({"bg_color": "#FFC7CE"})
+            for r in red_rows:
+                ws.set_row(int(r), None, red_fmt)
 
     print(f"Saved: {out_path}")
     print(stats_df.to_string(index=False))
@@ -1,14 +1,14 @@
 import re
-from difflib import SequenceMatcher
 from pathlib import Path
 
 import pandas as pd
+from rapidfuzz import fuzz, process
 
 BASE_DIR = Path(__file__).resolve().parent
 OURS_XLSX = BASE_DIR / "deals_changes.xlsx"
 OUT_XLSX = BASE_DIR / "compare_knru_vs_ours.xlsx"
 
-STOP_WORDS = {
+STOP_WORDS = frozenset({
     "ул",
     "улица",
     "пр",
@@ -31,50 +31,67 @@ STOP_WORDS = {
     "строение",
     "лит",
     "литер",
-}
+})
+
+
+# Регэкспы компилируются один раз на модуль: функции ниже зовутся на
+# каждую строку обоих датафреймов. Пунктуация вычищается таблицей
+# str.translate — для простого класса символов это заметно быстрее
+# регэкспа, а после схлопывания пробелов результат тот же.
+_PUNCT_TABLE = str.maketrans({c: " " for c in ",.;:()\"'`"})
+_WS_RE = re.compile(r"\s+")
+_HOUSE_RE = re.compile(
+    r"\b(?:д(?:ом)?\.?\s*)?(\d+[а-яa-z]?(?:/\d+[а-яa-z]?)?)"
+    r"(?:\s*(?:к|корпус)\.?\s*(\d+[а-яa-z]?))?"
+    r"(?:\s*(?:стр|строение)\.?\s*(\d+[а-яa-z]?))?"
+    r"(?:\s*(?:лит|литер)\.?\s*([а-яa-z]))?",
+    re.I,
+)
+_HOUSE_WORD_RE = re.compile(r"\b(?:д|дом)\.?\s*\d+[а-яa-z]?(?:/\d+[а-яa-z]?)?\b")
+_NUM_TOKEN_RE = re.compile(r"\b\d+[а-яa-z]?(?:/\d+[а-яa-z]?)?\b")
+_CORP_TOKEN_RE = re.compile(r"\b(?:к|корпус|стр|строение|лит|литер)\.?\s*[а-яa-z0-9]+\b")
+# Все стоп-слова одной альтернацией: строка сканируется один раз, без
+# split и списков на каждый вызов. Якоря по пробелам, а не \b, чтобы
+# токены вида "пр-" не резались посередине.
+_STOP_RE = re.compile(
+    r"(?:(?<=^)|(?<=\s))(?:" + "|".join(sorted(STOP_WORDS, key=len, reverse=True)) + r")(?=\s|$)"
+)
 
 
 def norm_text(s: str) -> str:
-    s = (s or "").strip().lower().replace("ё", "е")
-    s = re.sub(r"[,\.;:()\"'`]+", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
+    s = (s or "").strip().lower().replace("ё", "е").translate(_PUNCT_TABLE)
+    s = _WS_RE.sub(" ", s).strip()
     return s
 
 
-def extract_house(raw: str) -> str:
-    s = norm_text(raw)
-    m = re.search(
-        r"\b(?:д(?:ом)?\.?\s*)?(\d+[а-яa-z]?(?:/\d+[а-яa-z]?)?)"
-        r"(?:\s*(?:к|корпус)\.?\s*(\d+[а-яa-z]?))?"
-        r"(?:\s*(?:стр|строение)\.?\s*(\d+[а-яa-z]?))?"
-        r"(?:\s*(?:лит|литер)\.?\s*([а-яa-z]))?",
-        s,
-        flags=re.I,
-    )
-    if not m:
-        return ""
-    out = m.group(1)
-    if m.group(2):
-        out += f" к{m.group(2)}"
-    if m.group(3):
-        out += f" стр{m.group(3)}"
-    if m.group(4):
-        out += f" лит {m.group(4)}"
-    return out.strip()
+def vec_norm_text(s: pd.Series) -> pd.Series:
+    # Те же шаги, что в norm_text, но через str-аксессоры по всей колонке.
+    s = s.fillna("").astype(str).str.strip().str.lower().str.replace("ё", "е", regex=False)
+    s = s.str.translate(_PUNCT_TABLE)
+    return s.str.replace(_WS_RE, " ", regex=True).str.strip()
+
+
+def vec_extract_house(addr: pd.Series) -> pd.Series:
+    # str.extract отдаёт четыре группы дома разом; склейка тоже векторная.
+    g = vec_norm_text(addr).str.extract(_HOUSE_RE)
+    out = g[0].fillna("")
+    for idx, prefix in ((1, " к"), (2, " стр"), (3, " лит ")):
+        mask = g[idx].notna()
+        out.loc[mask] = out.loc[mask] + prefix + g[idx].loc[mask]
+    return out.str.strip()
 
 
 def make_name_key(text: str) -> str:
-    s = norm_text(text)
-    parts = [p for p in s.split() if p not in STOP_WORDS]
-    return " ".join(parts).strip()
+    s = _STOP_RE.sub("", norm_text(text))
+    return _WS_RE.sub(" ", s).strip()
 
 
 def extract_street_hint(raw_address: str) -> str:
     s = norm_text(raw_address)
-    s = re.sub(r"\b(?:д|дом)\.?\s*\d+[а-яa-z]?(?:/\d+[а-яa-z]?)?\b", " ", s)
-    s = re.sub(r"\b\d+[а-яa-z]?(?:/\d+[а-яa-z]?)?\b", " ", s)
-    s = re.sub(r"\b(?:к|корпус|стр|строение|лит|литер)\.?\s*[а-яa-z0-9]+\b", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _HOUSE_WORD_RE.sub(" ", s)
+    s = _NUM_TOKEN_RE.sub(" ", s)
+    s = _CORP_TOKEN_RE.sub(" ", s)
+    s = _WS_RE.sub(" ", s).strip()
     if "," in s:
         s = s.split(",")[-1].strip() or s
     return s
@@ -87,21 +104,19 @@ def latest_knru_file() -> Path:
     return files[-1]
 
 
-def best_street_match(street_key: str, pool: list[str]):
-    if not street_key:
-        return "", 0
-    best_key = ""
-    best_score = 0
-    for candidate in pool:
-        if not candidate:
-            continue
-        if abs(len(street_key) - len(candidate)) > 10:
-            continue
-        score = int(SequenceMatcher(None, street_key, candidate).ratio() * 100)
-        if score > best_score:
-            best_score = score
-            best_key = candidate
-    return best_key, best_score
+def best_street_matches(street_keys: list[str], pool: list[str]) -> dict[str, tuple[str, int]]:
+    """Лучший ключ улицы из pool для каждого street_key одной матрицей cdist."""
+    out = {s: ("", 0) for s in street_keys}
+    todo = [s for s in street_keys if s]
+    if not todo or not pool:
+        return out
+    # Одна многопоточная матрица схожести вместо extractOne на каждую улицу.
+    scores = process.cdist(todo, pool, scorer=fuzz.ratio, workers=-1)
+    best_idx = scores.argmax(axis=1)
+    for s, bi, sc in zip(todo, best_idx, scores.max(axis=1)):
+        if int(sc) > 0:
+            out[s] = (pool[int(bi)], int(sc))
+    return out
 
 
 def main():
@@ -111,76 +126,74 @@ def main():
     comp = pd.read_csv(comp_csv)
 
     ours["our_street_key"] = ours["street_key"].fillna("").map(make_name_key)
-    ours["our_house_key"] = ours["house_part"].fillna("").map(norm_text)
+    ours["our_house_key"] = vec_norm_text(ours["house_part"])
     ours["our_cmp_key"] = ours["our_street_key"] + "::" + ours["our_house_key"]
 
     ours_valid = ours[ours["our_street_key"] != ""].copy()
     ours_valid = ours_valid.drop_duplicates(subset=["our_cmp_key", "crm_url"], keep="first")
 
     comp["comp_address"] = comp["address"].fillna("")
-    comp["comp_house_key"] = comp["comp_address"].map(extract_house).map(norm_text)
+    # vec_extract_house собирает ключ из уже нормализованной строки —
+    # повторный прогон нормализации поверх ничего не меняет.
+    comp["comp_house_key"] = vec_extract_house(comp["comp_address"])
     comp["comp_street_hint"] = comp["comp_address"].map(extract_street_hint)
     comp["comp_street_key"] = comp["comp_street_hint"].map(make_name_key)
     comp["comp_cmp_key"] = comp["comp_street_key"] + "::" + comp["comp_house_key"]
 
-    our_exact_keys = set(ours_valid["our_cmp_key"].tolist())
     our_street_pool = sorted(set(ours_valid["our_street_key"].tolist()))
 
-    match_rows = []
-    competitor_only_rows = []
-
-    for _, row in comp.iterrows():
-        c_key = row["comp_cmp_key"]
-        c_street = row["comp_street_key"]
-
-        if c_key in our_exact_keys and c_key.strip(":"):
-            matched = ours_valid[ours_valid["our_cmp_key"] == c_key].head(1).iloc[0]
-            out = dict(row)
-            out.update(
-                {
-                    "match_type": "exact",
-                    "match_score": 100,
-                    "our_address_canonical": matched.get("address_canonical", ""),
-                    "our_crm_url": matched.get("crm_url", ""),
-                    "our_norm_status": matched.get("norm_status", ""),
-                }
-            )
-            match_rows.append(out)
-            continue
-
-        best_street, score = best_street_match(c_street, our_street_pool)
-        if best_street and score >= 90 and row["comp_house_key"]:
-            subset = ours_valid[
-                (ours_valid["our_street_key"] == best_street)
-                & (ours_valid["our_house_key"] == row["comp_house_key"])
-            ]
-            if not subset.empty:
-                matched = subset.head(1).iloc[0]
-                out = dict(row)
-                out.update(
-                    {
-                        "match_type": "fuzzy_street+house",
-                        "match_score": score,
-                        "our_address_canonical": matched.get("address_canonical", ""),
-                        "our_crm_url": matched.get("crm_url", ""),
-                        "our_norm_status": matched.get("norm_status", ""),
-                    }
-                )
-                match_rows.append(out)
-                continue
-
-        out = dict(row)
-        out.update(
-            {
-                "match_type": "not_found",
-                "match_score": score,
-                "best_our_street_key": best_street,
-            }
-        )
-        competitor_only_rows.append(out)
-
-    matched_df = pd.DataFrame(match_rows)
-    competitor_only_df = pd.DataFrame(competitor_only_rows)
+    comp = comp.reset_index(drop=True)
+    our_cols = ["our_address_canonical", "our_crm_url", "our_norm_status"]
+    rename_our = {"address_canonical": "our_address_canonical", "crm_url": "our_crm_url", "norm_status": "our_norm_status"}
+    matched_cols = list(comp.columns) + ["match_type", "match_score"] + our_cols
+
+    # Точная фаза: один merge по составному ключу вместо O(N) скана на строку.
+    ours_by_key = ours_valid.drop_duplicates("our_cmp_key")[
+        ["our_cmp_key", "address_canonical", "crm_url", "norm_status"]
+    ].rename(columns=rename_our)
+    merged = comp.merge(ours_by_key, left_on="comp_cmp_key", right_on="our_cmp_key", how="left")
+    exact_mask = merged["our_cmp_key"].notna() & (comp["comp_cmp_key"].str.strip(":") != "")
+
+    exact_df = merged[exact_mask].copy()
+    exact_df["match_type"] = "exact"
+    exact_df["match_score"] = 100
+    exact_df = exact_df[matched_cols]
+
+    # Нечёткая фаза: лучший ключ улицы для оставшихся, затем merge по (улица, дом).
+    rest = comp[~exact_mask].copy()
+    best_map = best_street_matches(list(rest["comp_street_key"].unique()), our_street_pool)
+    rest["best_our_street_key"] = rest["comp_street_key"].map(lambda s: best_map[s][0])
+    rest["match_score"] = rest["comp_street_key"].map(lambda s: best_map[s][1])
+
+    fuzzy_mask = (
+        (rest["best_our_street_key"] != "") & (rest["match_score"] >= 90) & (rest["comp_house_key"] != "")
+    )
+    ours_by_sh = ours_valid.drop_duplicates(["our_street_key", "our_house_key"])[
+        ["our_street_key", "our_house_key", "address_canonical", "crm_url", "norm_status"]
+    ].rename(columns=rename_our)
+    fz = rest[fuzzy_mask].reset_index().merge(
+        ours_by_sh,
+        left_on=["best_our_street_key", "comp_house_key"],
+        right_on=["our_street_key", "our_house_key"],
+        how="left",
+    ).set_index("index")
+    fz_hit = fz["our_street_key"].notna()
+
+    fuzzy_df = fz[fz_hit].copy()
+    fuzzy_df["match_type"] = "fuzzy_street+house"
+    fuzzy_df = fuzzy_df[matched_cols]
+
+    only_idx = rest.index.difference(fz[fz_hit].index)
+    competitor_only_df = rest.loc[only_idx].copy()
+    competitor_only_df["match_type"] = "not_found"
+    competitor_only_df = competitor_only_df[list(comp.columns) + ["match_type", "match_score", "best_our_street_key"]]
+
+    if len(exact_df) or len(fuzzy_df):
+        matched_df = pd.concat([exact_df, fuzzy_df]).sort_index()
+    else:
+        matched_df = pd.DataFrame()
+    if competitor_only_df.empty:
+        competitor_only_df = pd.DataFrame()
 
     matched_keys = set(matched_df.get("our_crm_url", pd.Series(dtype=str)).dropna().tolist())
     ours_only_df = ours_valid[~ours_valid["crm_url"].isin(matched_keys)].copy()
@@ -194,7 +207,11 @@ def main():
         ]
     )
 
-    with pd.ExcelWriter(OUT_XLSX, engine="openpyxl") as w:
+    # xlsxwriter пишет листы потоково, без графа ячеек openpyxl;
+    # strings_to_urls=False — колонки со ссылками остаются текстом.
+    with pd.ExcelWriter(
+        OUT_XLSX, engine="xlsxwriter", engine_kwargs={"options": {"strings_to_urls": False}}
+    ) as w:
         summary.to_excel(w, sheet_name="summary", index=False)
         comp.to_excel(w, sheet_name="competitor_all", index=False)
         matched_df.to_excel(w, sheet_name="matched", index=False)
@@ -1,10 +1,11 @@
 from playwright.sync_api import sync_playwright
 import re
 import json
-import csv
 from datetime import date
 from pathlib import Path
 
+import pandas as pd
+
 START_URL = "https://knru.ru/commercial/"
 BASE = "https://knru.ru"
 HEADLESS = False
@@ -31,19 +32,42 @@ def extract_first_number(text):
         return None
 
 
-def get_title_from_card(card):
-    if card.locator("a.product-item-name").count() > 0:
-        t = clean_text(card.locator("a.product-item-name").first.inner_text())
-        if t:
-            return t
-
-    if card.locator("div.product-item__more").count() > 0:
-        t = clean_text(card.locator("div.product-item__more").first.inner_text())
-        if t:
-            t = t.replace("На карте", "").strip()
-            parts = [p.strip() for p in t.split("\n") if p.strip()]
-            if parts:
-                return parts[0]
+# Каждый locator().count()/inner_text() — отдельный RPC в браузер; на сотне
+# карточек это тысячи запросов. Снимаем все карточки одним evaluate:
+# null в поле значит "элемента нет", пустая строка — "есть, но пустой".
+_CARDS_JS = """
+() => Array.from(document.querySelectorAll("div.product-item-container")).map((c) => {
+  const text = (sel) => {
+    const el = c.querySelector(sel);
+    return el ? el.innerText : null;
+  };
+  const a = c.querySelector('a[href^="/catalog/"]');
+  return {
+    href: a ? a.getAttribute("href") : null,
+    title: text("a.product-item-name"),
+    more: text("div.product-item__more"),
+    address_span: text("div.product-item__adress span"),
+    address_div: text("div.product-item__adress"),
+    district_title: text("div.district__title"),
+    district_a: text("a.district"),
+    price: text("div.product-item__price"),
+    area: text("div.square__title"),
+  };
+})
+"""
+
+
+def title_from_fields(card):
+    t = clean_text(card["title"])
+    if t:
+        return t
+
+    t = clean_text(card["more"])
+    if t:
+        t = t.replace("На карте", "").strip()
+        parts = [p.strip() for p in t.split("\n") if p.strip()]
+        if parts:
+            return parts[0]
 
     return None
 
@@ -51,41 +75,28 @@ def get_title_from_card(card):
 def parse_one_page(page):
     page.wait_for_selector("div.product-item-container", timeout=60_000)
 
-    cards = page.locator("div.product-item-container")
-    total = cards.count()
     rows = []
+    for card in page.evaluate(_CARDS_JS):
+        url = BASE + card["href"] if card["href"] else None
 
-    for i in range(total):
-        card = cards.nth(i)
-
-        url = None
-        a_catalog = card.locator('a[href^="/catalog/"]').first
-        if a_catalog.count() > 0:
-            href = a_catalog.get_attribute("href")
-            if href:
-                url = BASE + href
-
-        title = get_title_from_card(card)
+        title = title_from_fields(card)
 
         address = None
-        if card.locator("div.product-item__adress span").count() > 0:
-            address = clean_text(card.locator("div.product-item__adress span").first.inner_text())
-        elif card.locator("div.product-item__adress").count() > 0:
-            address = clean_text(card.locator("div.product-item__adress").first.inner_text())
+        if card["address_span"] is not None:
+            address = clean_text(card["address_span"])
+        elif card["address_div"] is not None:
+            address = clean_text(card["address_div"])
         if address:
             address = address.replace("На карте", "").strip()
 
         district = None
-        if card.locator("div.district__title").count() > 0:
-            district = clean_text(card.locator("div.district__title").first.inner_text())
-        elif card.locator("a.district").count() > 0:
-            district = clean_text(card.locator("a.district").first.inner_text())
-
-        price_txt = clean_text(card.locator("div.product-item__price").first.inner_text()) if card.locator("div.product-item__price").count() else None
-        price_rub = extract_first_number(price_txt)
+        if card["district_title"] is not None:
+            district = clean_text(card["district_title"])
+        elif card["district_a"] is not None:
+            district = clean_text(card["district_a"])
 
-        area_txt = clean_text(card.locator("div.square__title").first.inner_text()) if card.locator("div.square__title").count() else None
-        area_m2 = extract_first_number(area_txt)
+        price_rub = extract_first_number(clean_text(card["price"]))
+        area_m2 = extract_first_number(clean_text(card["area"]))
 
         rows.append(
             {
@@ -108,12 +119,10 @@ def save_json(path, rows):
 
 
 def save_csv(path, rows):
+    # C-писатель pandas вместо DictWriter с диспетчеризацией на строку.
     fields = ["deal_type", "title", "address", "district", "price_rub", "area_m2", "url"]
-    with open(path, "w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=fields)
-        w.writeheader()
-        for r in rows:
-            w.writerow(r)
+    # dtype=object, чтобы None в числовой колонке не переводил int во float.
+    pd.DataFrame(rows, columns=fields, dtype=object).to_csv(path, index=False, encoding="utf-8")
 
 
 def main():
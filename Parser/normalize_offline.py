@@ -3,16 +3,17 @@
 
 import json
 import re
-import xml.etree.ElementTree as ET
+from lxml import etree as ET
+from collections import namedtuple
 from dataclasses import dataclass
-from difflib import get_close_matches
-from difflib import SequenceMatcher
 from pathlib import Path
 from typing import Optional
 
 import geopandas as gpd
+import numpy as np
 import pandas as pd
-from shapely.geometry import Point, box
+from rapidfuzz import fuzz, process
+from shapely.geometry import box
 from shapely.strtree import STRtree
 
 
@@ -48,7 +49,7 @@ PLACE_MAX_DIST_M = 30000.0
 FUZZY_TYPO_THRESHOLD = 88
 MISMATCH_THRESHOLD = 65
 
-STOP_WORDS = {
+STOP_WORDS = frozenset({
     "ул",
     "улица",
     "пр",
@@ -73,7 +74,7 @@ STOP_WORDS = {
     "стр",
     "лит",
     "литер",
-}
+})
 
 
 @dataclass
@@ -84,29 +85,44 @@ class Nearby:
     distance_m: Optional[float]
 
 
+# Регэкспы компилируются один раз на модуль — функции нормализации
+# зовутся на каждый item и каждую строку каталога улиц. Пунктуация
+# вычищается таблицей str.translate: для простого класса символов это
+# быстрее регэкспа, а после схлопывания пробелов результат тот же.
+_PUNCT_TABLE = str.maketrans({c: " " for c in ",.;:()\"'`"})
+_WS_RE = re.compile(r"\s+")
+_HOUSE_RE = re.compile(
+    r"\b(?:д(?:ом)?\.?\s*)?(\d+[а-яa-z]?(?:/\d+[а-яa-z]?)?)"
+    r"(?:\s*(?:к|корпус)\.?\s*(\d+[а-яa-z]?))?"
+    r"(?:\s*(?:стр|строение)\.?\s*(\d+[а-яa-z]?))?"
+    r"(?:\s*(?:лит|литер)\.?\s*([а-яa-z]))?",
+    re.I,
+)
+_HOUSE_WORD_RE = re.compile(r"\b(?:д|дом)\.?\s*\d+[а-яa-z]?(?:/\d+[а-яa-z]?)?\b")
+_NUM_TOKEN_RE = re.compile(r"\b\d+[а-яa-z]?(?:/\d+[а-яa-z]?)?\b")
+_CORP_TOKEN_RE = re.compile(r"\b(?:к|корпус|стр|строение|лит|литер)\.?\s*[а-яa-z0-9]+\b")
+# Все стоп-слова одной альтернацией: строка сканируется один раз, без
+# split и списков на каждый вызов. Якоря по пробелам, а не \b, чтобы
+# токены вида "пр-" не резались посередине.
+_STOP_RE = re.compile(
+    r"(?:(?<=^)|(?<=\s))(?:" + "|".join(sorted(STOP_WORDS, key=len, reverse=True)) + r")(?=\s|$)"
+)
+
+
 def norm_text(s: str) -> str:
-    s = (s or "").lower().replace("ё", "е")
-    s = re.sub(r"[,\.;:()\"'`]+", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
+    s = (s or "").lower().replace("ё", "е").translate(_PUNCT_TABLE)
+    s = _WS_RE.sub(" ", s).strip()
     return s
 
 
 def make_name_key(text: str) -> str:
-    s = norm_text(text)
-    parts = [p for p in s.split() if p not in STOP_WORDS]
-    return " ".join(parts).strip()
+    s = _STOP_RE.sub("", norm_text(text))
+    return _WS_RE.sub(" ", s).strip()
 
 
 def extract_house(text: str) -> str:
     s = norm_text(text)
-    m = re.search(
-        r"\b(?:д(?:ом)?\.?\s*)?(\d+[а-яa-z]?(?:/\d+[а-яa-z]?)?)"
-        r"(?:\s*(?:к|корпус)\.?\s*(\d+[а-яa-z]?))?"
-        r"(?:\s*(?:стр|строение)\.?\s*(\d+[а-яa-z]?))?"
-        r"(?:\s*(?:лит|литер)\.?\s*([а-яa-z]))?",
-        s,
-        flags=re.I,
-    )
+    m = _HOUSE_RE.search(s)
     if not m:
         return ""
     base = m.group(1)
@@ -123,31 +139,31 @@ def extract_house(text: str) -> str:
     return result.strip()
 
 
-def parse_coords(coords_text: str) -> Optional[tuple[float, float]]:
-    if not coords_text:
-        return None
-    raw = coords_text.strip()
-    if not raw:
-        return None
-    parts = [p.strip() for p in raw.split(",")]
-    if len(parts) != 2:
-        return None
-    try:
-        a = float(parts[0])
-        b = float(parts[1])
-    except ValueError:
-        return None
-    if abs(a) < 1e-9 and abs(b) < 1e-9:
-        return None
-    if 27 <= a <= 35 and 55 <= b <= 61:
-        lon, lat = a, b
-    elif 55 <= a <= 61 and 27 <= b <= 35:
-        lat, lon = a, b
-    else:
-        lon, lat = a, b
-    if not (-180 <= lon <= 180 and -90 <= lat <= 90):
-        return None
-    return lon, lat
+def vec_parse_coords(coords_texts: list[str]) -> list[Optional[tuple[float, float]]]:
+    # Разбор всех координат одной колонкой: split/to_numeric/np.where вместо
+    # питоновской функции на каждый item; своп широты/долготы — маской.
+    if not coords_texts:
+        return []
+    s = pd.Series(coords_texts, dtype="object").fillna("").astype(str).str.strip()
+    parts = s.str.split(",", n=1, expand=True)
+    if parts.shape[1] < 2:
+        parts[1] = None
+    a = pd.to_numeric(parts[0].str.strip(), errors="coerce")
+    b = pd.to_numeric(parts[1].str.strip(), errors="coerce")
+    valid = (
+        (s.str.count(",") == 1)
+        & a.notna()
+        & b.notna()
+        & ~((a.abs() < 1e-9) & (b.abs() < 1e-9))
+    )
+    swap = a.between(55, 61) & b.between(27, 35)
+    lon = np.where(swap, b, a)
+    lat = np.where(swap, a, b)
+    valid &= (lon >= -180) & (lon <= 180) & (lat >= -90) & (lat <= 90)
+    return [
+        (float(lo), float(la)) if ok else None
+        for ok, lo, la in zip(valid.to_numpy(), lon, lat)
+    ]
 
 
 def bbox_from_coords(coords: list[tuple[float, float]]):
@@ -180,112 +196,104 @@ def build_street_catalog(roads: gpd.GeoDataFrame, places: gpd.GeoDataFrame):
     roads = roads.copy()
     roads["name_key"] = roads["name"].map(make_name_key)
     roads = roads[roads["name_key"] != ""].copy()
-    grp = roads.groupby("name_key", as_index=False).agg(
-        street_name=("name", lambda x: x.mode().iloc[0] if not x.mode().empty else x.iloc[0]),
+    # Самое частое написание имени — через size + drop_duplicates, без
+    # питоновской лямбды с mode() на каждую группу; при равных частотах
+    # берём алфавитно меньшее, как делал mode().iloc[0].
+    counts = roads.groupby(["name_key", "name"], sort=False).size().reset_index(name="n")
+    counts = counts.sort_values(["name_key", "n", "name"], ascending=[True, False, True])
+    top = counts.drop_duplicates("name_key")[["name_key", "name"]].rename(columns={"name": "street_name"})
+    firsts = roads.groupby("name_key", as_index=False).agg(
         street_fclass=("fclass", "first"),
         sample_osm_id=("osm_id", "first"),
     )
+    grp = top.merge(firsts, on="name_key", how="left")
     place_keys = set(places["name"].astype(str).map(make_name_key).tolist())
     grp = grp[~grp["name_key"].isin(place_keys)].copy()
     return grp
 
 
+StreetRecord = namedtuple("StreetRecord", ["name_key", "street_name", "street_fclass", "sample_osm_id"])
+
+
 def build_fuzzy_index(catalog: pd.DataFrame):
+    # Лёгкие namedtuple вместо словарей на строку плюс готовый список
+    # ключей: rapidfuzz получает один и тот же список без пересборки.
     exact = {}
-    by_first = {}
-    for _, row in catalog.iterrows():
-        key = str(row["name_key"])
-        exact[key] = row
-        first = key[:1]
-        by_first.setdefault(first, []).append(row)
-    return exact, by_first
+    for t in catalog[["name_key", "street_name", "street_fclass", "sample_osm_id"]].itertuples(index=False, name=None):
+        rec = StreetRecord(str(t[0]), t[1], t[2], t[3])
+        exact[rec.name_key] = rec
+    return exact, list(exact.keys())
 
 
-def best_fuzzy(street_key: str, catalog: pd.DataFrame, exact_idx: dict, by_first_idx: dict):
+def best_fuzzy(street_key: str, exact_idx: dict, name_keys: list[str]):
     if not street_key:
         return None, 0
     if street_key in exact_idx:
         return exact_idx[street_key], 100
 
-    candidates = by_first_idx.get(street_key[:1], [])
-    if not candidates:
-        candidates = list(catalog.to_dict("records"))
-    if len(candidates) > 1500:
-        shortlist_keys = get_close_matches(
-            street_key,
-            [str(r["name_key"]) for r in candidates],
-            n=12,
-            cutoff=0.55,
-        )
-        allowed = set(shortlist_keys)
-        if allowed:
-            candidates = [r for r in candidates if str(r["name_key"]) in allowed]
-
-    best_row = None
-    best_score = 0
-    for row in candidates:
-        key = str(row["name_key"])
-        if abs(len(street_key) - len(key)) > 10:
-            continue
-        score = int(SequenceMatcher(None, street_key, key).ratio() * 100)
-        if score > best_score:
-            best_score = score
-            best_row = row
-    return best_row, best_score
+    # rapidfuzz прогоняет весь каталог в C быстрее, чем difflib по
+    # шорт-листу, — бакеты по первой букве и get_close_matches не нужны.
+    found = process.extractOne(street_key, name_keys, scorer=fuzz.ratio)
+    if found is None:
+        return None, 0
+    key, score, _ = found
+    if int(score) <= 0:
+        return None, 0
+    return exact_idx[key], int(score)
 
 
 def extract_raw_street_hint(raw_address: str) -> str:
     s = norm_text(raw_address)
     if not s:
         return ""
-    s = re.sub(r"\b(?:д|дом)\.?\s*\d+[а-яa-z]?(?:/\d+[а-яa-z]?)?\b", " ", s)
-    s = re.sub(r"\b\d+[а-яa-z]?(?:/\d+[а-яa-z]?)?\b", " ", s)
-    s = re.sub(r"\b(?:к|корпус|стр|строение|лит|литер)\.?\s*[а-яa-z0-9]+\b", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _HOUSE_WORD_RE.sub(" ", s)
+    s = _NUM_TOKEN_RE.sub(" ", s)
+    s = _CORP_TOKEN_RE.sub(" ", s)
+    s = _WS_RE.sub(" ", s).strip()
     if "," in s:
         s = s.split(",")[-1].strip() or s
     return s
 
 
-def set_text(item: ET.Element, tag: str, text: str):
-    el = item.find(tag)
-    if el is None:
-        el = ET.SubElement(item, tag)
-    el.text = text
+def set_texts(item, values: dict[str, str]):
+    # Один проход по детям item вместо item.find (линейного скана) на
+    # каждый из семи выходных тегов.
+    existing = {child.tag: child for child in item}
+    for tag, text in values.items():
+        el = existing.get(tag)
+        if el is None:
+            el = ET.SubElement(item, tag)
+        el.text = text
 
 
-def nearest_from_tree(
-    lon: float,
-    lat: float,
+def batch_nearest(
+    points_metric,
     gdf_wgs84: gpd.GeoDataFrame,
     gdf_metric: gpd.GeoDataFrame,
     tree: STRtree,
-    idx_by_geom_wkb: dict[bytes, int],
     max_distance_m: float,
-) -> Nearby:
-    point_wgs84 = Point(lon, lat)
-    point_metric = gpd.GeoSeries([point_wgs84], crs=4326).to_crs(gdf_metric.crs).iloc[0]
-    nearest_obj = tree.nearest(point_metric)
-    if nearest_obj is None:
-        return Nearby(None, "", "", None)
-    if isinstance(nearest_obj, (int,)):
-        idx = int(nearest_obj)
-    elif hasattr(nearest_obj, "item"):
-        idx = int(nearest_obj.item())
-    else:
-        idx = idx_by_geom_wkb.get(nearest_obj.wkb)
-        if idx is None:
-            return Nearby(None, "", "", None)
-    dist = float(point_metric.distance(gdf_metric.geometry.iloc[idx]))
-    if dist > max_distance_m:
-        return Nearby(None, "", "", dist)
-    row = gdf_wgs84.iloc[idx]
-    return Nearby(
-        osm_id=int(row["osm_id"]) if pd.notna(row["osm_id"]) else None,
-        name=str(row["name"]),
-        fclass=str(row["fclass"]),
-        distance_m=dist,
+) -> list[Nearby]:
+    # Shapely 2.0: query_nearest отсекает дальние точки ещё при спуске по
+    # R-дереву и сразу возвращает расстояния — без полного поиска
+    # ближайшего и повторного distance для каждой точки.
+    if len(points_metric) == 0:
+        return []
+    (pt_rows, tree_rows), dists = tree.query_nearest(
+        points_metric, max_distance=max_distance_m, return_distance=True, all_matches=False
     )
+    names = gdf_wgs84["name"].to_numpy()
+    fclasses = gdf_wgs84["fclass"].to_numpy()
+    osm_ids = gdf_wgs84["osm_id"].to_numpy()
+    out = [Nearby(None, "", "", None) for _ in range(len(points_metric))]
+    for pt_i, tree_i, dist in zip(pt_rows, tree_rows, dists):
+        osm_id = osm_ids[tree_i]
+        out[pt_i] = Nearby(
+            osm_id=int(osm_id) if pd.notna(osm_id) else None,
+            name=str(names[tree_i]),
+            fclass=str(fclasses[tree_i]),
+            distance_m=float(dist),
+        )
+    return out
 
 
 def canonical_address(place: str, street: str, house: str):
@@ -302,11 +310,13 @@ def canonical_address(place: str, street: str, house: str):
 def main():
     root = ET.parse(INPUT_XML).getroot()
     items = root.findall(".//item")
-    coords = []
-    for item in items:
-        parsed = parse_coords(item.findtext("coords") or "")
-        if parsed:
-            coords.append(parsed)
+    # Все поля item вычитываются один раз в колонки: findtext ходит по
+    # детям линейно, и в цикле его звать трижды на item незачем.
+    addresses = [(item.findtext("address") or "").strip() for item in items]
+    coords_texts = [(item.findtext("coords") or "").strip() for item in items]
+    crm_urls = [(item.findtext("crm_url") or "").strip() for item in items]
+    parsed_list = vec_parse_coords(coords_texts)
+    coords = [p for p in parsed_list if p]
     bbox_geom = bbox_from_coords(coords)
     roads, places = load_layers(bbox_geom)
     if roads.empty or places.empty:
@@ -316,23 +326,32 @@ def main():
     roads_m = roads.to_crs(metric_crs)
     places_m = places.to_crs(metric_crs)
 
-    road_geoms = list(roads_m.geometry.values)
-    place_geoms = list(places_m.geometry.values)
-    road_tree = STRtree(road_geoms)
-    place_tree = STRtree(place_geoms)
-    road_idx = {g.wkb: i for i, g in enumerate(road_geoms)}
-    place_idx = {g.wkb: i for i, g in enumerate(place_geoms)}
+    road_tree = STRtree(roads_m.geometry.values)
+    place_tree = STRtree(places_m.geometry.values)
+
+    # Все точки перепроецируются и матчатся с деревьями одним батчем;
+    # в цикле по item остаётся только чтение готовых результатов.
+    points_metric = (
+        gpd.GeoSeries.from_xy([p[0] for p in coords], [p[1] for p in coords], crs=4326)
+        .to_crs(metric_crs)
+        .values
+        if coords
+        else []
+    )
+    place_results = batch_nearest(points_metric, places, places_m, place_tree, PLACE_MAX_DIST_M)
+    road_results = batch_nearest(points_metric, roads, roads_m, road_tree, ROAD_MAX_DIST_M)
 
     catalog = build_street_catalog(roads, places)
-    exact_idx, by_first_idx = build_fuzzy_index(catalog)
+    exact_idx, name_keys = build_fuzzy_index(catalog)
     out_rows = []
+    point_no = 0
 
     for i, item in enumerate(items, start=1):
-        raw_address = (item.findtext("address") or "").strip()
-        coords_text = (item.findtext("coords") or "").strip()
-        crm_url = (item.findtext("crm_url") or "").strip()
+        raw_address = addresses[i - 1]
+        coords_text = coords_texts[i - 1]
+        crm_url = crm_urls[i - 1]
         house_part = extract_house(raw_address)
-        parsed = parse_coords(coords_text)
+        parsed = parsed_list[i - 1]
 
         matched_place = ""
         matched_street = ""
@@ -345,13 +364,9 @@ def main():
         hint_key = make_name_key(street_hint)
 
         if parsed:
-            lon, lat = parsed
-            place = nearest_from_tree(
-                lon, lat, places, places_m, place_tree, place_idx, PLACE_MAX_DIST_M
-            )
-            road = nearest_from_tree(
-                lon, lat, roads, roads_m, road_tree, road_idx, ROAD_MAX_DIST_M
-            )
+            place = place_results[point_no]
+            road = road_results[point_no]
+            point_no += 1
             matched_place = place.name
             place_dist = place.distance_m
             matched_street = road.name
@@ -360,38 +375,43 @@ def main():
             if matched_street:
                 final_addr = canonical_address(matched_place, matched_street, house_part)
                 if hint_key:
-                    score = int(SequenceMatcher(None, hint_key, make_name_key(matched_street)).ratio() * 100)
+                    score = int(fuzz.ratio(hint_key, make_name_key(matched_street)))
                     status = "coords_mismatch" if score < MISMATCH_THRESHOLD else "ok"
                 else:
                     status = "ok"
                 if not house_part:
                     status = f"{status};house_missing"
             else:
-                best, score = best_fuzzy(hint_key, catalog, exact_idx, by_first_idx)
+                best, score = best_fuzzy(hint_key, exact_idx, name_keys)
                 if best is not None and score >= FUZZY_TYPO_THRESHOLD:
-                    matched_street = str(best["street_name"])
+                    matched_street = str(best.street_name)
                     final_addr = canonical_address(matched_place, matched_street, house_part)
                     status = "typo_suspected"
                 else:
                     final_addr = canonical_address(matched_place, "", house_part)
                     status = "candidate_new"
         else:
-            best, score = best_fuzzy(hint_key, catalog, exact_idx, by_first_idx)
+            best, score = best_fuzzy(hint_key, exact_idx, name_keys)
             if best is not None and score >= FUZZY_TYPO_THRESHOLD:
-                matched_street = str(best["street_name"])
+                matched_street = str(best.street_name)
                 final_addr = canonical_address("", matched_street, house_part)
                 status = "no_coords_typo_suspected"
             else:
                 final_addr = canonical_address("", street_hint, house_part)
                 status = "no_coords_candidate_new" if raw_address else "no_coords_no_address"
 
-        set_text(item, "address_canonical", final_addr)
-        set_text(item, "house_part", house_part)
-        set_text(item, "matched_place", matched_place)
-        set_text(item, "matched_street", matched_street)
-        set_text(item, "distance_place_m", "" if place_dist is None else f"{place_dist:.1f}")
-        set_text(item, "distance_street_m", "" if street_dist is None else f"{street_dist:.1f}")
-        set_text(item, "norm_status", status)
+        set_texts(
+            item,
+            {
+                "address_canonical": final_addr,
+                "house_part": house_part,
+                "matched_place": matched_place,
+                "matched_street": matched_street,
+                "distance_place_m": "" if place_dist is None else f"{place_dist:.1f}",
+                "distance_street_m": "" if street_dist is None else f"{street_dist:.1f}",
+                "norm_status": status,
+            },
+        )
 
         out_rows.append(
             {
@@ -412,7 +432,10 @@ def main():
         )
 
     ET.ElementTree(root).write(OUTPUT_XML, encoding="utf-8", xml_declaration=True)
-    pd.DataFrame(out_rows).to_excel(OUTPUT_XLSX, index=False)
+    with pd.ExcelWriter(
+        OUTPUT_XLSX, engine="xlsxwriter", engine_kwargs={"options": {"strings_to_urls": False}}
+    ) as w:
+        pd.DataFrame(out_rows).to_excel(w, index=False)
 
     summary = pd.DataFrame(out_rows)["norm_status"].value_counts(dropna=False)
     print("Done.")
@@ -2,21 +2,29 @@
 # Сравнение объектов конкурентов с вашей базой deals.xml (rent+sale)
 # Вывод: CSV с кликабельными ссылками (HYPERLINK) для Google Sheets / Excel
 
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeoutError
+import asyncio
+import concurrent.futures
+import functools
+import heapq
+import os
 import re
 import csv
 import argparse
 import json
+from collections import namedtuple
+from dataclasses import dataclass
 from datetime import date
 from pathlib import Path
 import unicodedata
-import urllib.request
-import urllib.error
 import urllib.parse
 import time
 import random
 import ssl
 
+import httpx
+import numpy as np
+
 # ====== НАСТРОЙКИ ======
 COMPETITORS = {
     "knru": {
@@ -43,6 +51,19 @@ COMPETITORS = {
 
 HEADLESS = False
 
+# Сколько страниц каталога качаем параллельно (отдельными вкладками).
+MAX_PARALLEL_PAGES = 3
+
+# Сколько проверок watermark гоняем в браузере одновременно.
+PRO_DETECT_PARALLEL = 8
+
+# Сколько тайлов Яндекс-карты качаем одновременно.
+YA_TILE_WORKERS = 8
+
+# С какого числа карточек распараллеливаем сравнение по процессам:
+# на мелких отчётах форк и пересылка индекса дороже самого сравнения.
+REPORT_PARALLEL_MIN_ROWS = 2000
+
 # ваш XML лежит рядом с robot.py в папке Parser:
 MY_XML_FILENAME = "deals.xml"
 
@@ -51,17 +72,32 @@ AREA_TOL = 5.0
 
 
 # ====== УТИЛИТЫ ТЕКСТА / ЧИСЕЛ ======
+# Регэкспы компилируются один раз на модуль: эти функции зовутся на каждую
+# строку deals.xml и каждую карточку конкурента, а re.compile-кэш всё равно
+# платит за lookup и разбор флагов на каждый вызов.
+_NUM_RE = re.compile(r"(\d[\d\s]*[.,]?\d*)")
+_ID_TAIL_RE = re.compile(r"-(\d+)/?$")
+_PUNCT_RE = re.compile(r"[\.;:\(\)\[\]\{\}]")
+_COMMA_RE = re.compile(r"\s*,\s*")
+_WS_RE = re.compile(r"\s+")
+
+
+# Невидимые пробелы из вёрстки одной C-таблицей: NBSP, тонкий и узкий
+# пробел становятся обычным, zero-width выбрасывается совсем.
+_CLEAN_TRANS = str.maketrans({"\xa0": " ", "\u2009": " ", "\u202f": " ", "\u200b": None})
+
+
 def clean_text(s: str | None) -> str | None:
     if not s:
         return None
-    return s.replace("\xa0", " ").strip()
+    return s.translate(_CLEAN_TRANS).strip()
 
 
 def extract_first_number(text: str | None):
     if not text:
         return None
     t = clean_text(text) or ""
-    m = re.search(r"(\d[\d\s]*[.,]?\d*)", t)
+    m = _NUM_RE.search(t)
     if not m:
         return None
     num = m.group(1).replace(" ", "").replace(",", ".")
@@ -76,7 +112,7 @@ def extract_all_numbers(text: str | None):
         return []
     t = clean_text(text) or ""
     out = []
-    for m in re.finditer(r"(\d[\d\s]*[.,]?\d*)", t):
+    for m in _NUM_RE.finditer(t):
         num = m.group(1).replace(" ", "").replace(",", ".")
         try:
             out.append(float(num) if "." in num else int(num))
@@ -118,17 +154,23 @@ def format_int_spaces(x):
     return f"{n:,}".replace(",", " ")
 
 
+# Текст ссылки почти всегда дефолтный — держим готовый format под него.
+_HL_FMT = '=HYPERLINK("{}","ссылка")'.format
+
+
 def hyperlink(url: str | None, text="ссылка"):
     if not url:
         return ""
     # Формула для Google Sheets/Excel
+    if text == "ссылка":
+        return _HL_FMT(url)
     return f'=HYPERLINK("{url}","{text}")'
 
 
 def extract_listing_id(url: str | None) -> str:
     if not url:
         return ""
-    m = re.search(r"-(\d+)/?$", url.strip())
+    m = _ID_TAIL_RE.search(url.strip())
     return m.group(1) if m else ""
 
 
@@ -152,6 +194,10 @@ def absolute_url(base_url: str, url: str | None):
     return base_url.rstrip("/") + "/" + s
 
 
+_NORM_TRANS = str.maketrans({"ё": "е", "№": "", "\\": " "})
+
+
+@functools.lru_cache(maxsize=65536)
 def norm_text(s: str) -> str:
     """
     Нормализация:
@@ -159,16 +205,19 @@ def norm_text(s: str) -> str:
     - lower
     - ё->е
     - убрать лишние знаки препинания
+
+    Рабочее множество строк за прогон небольшое (адреса, статусы, типы
+    сделки), поэтому результат мемоизируется. NFKC на ASCII — тождество,
+    пропускаем этот C-проход.
     """
-    s = unicodedata.normalize("NFKC", s)
+    if not s.isascii():
+        s = unicodedata.normalize("NFKC", s)
     s = s.lower()
-    s = s.replace("ё", "е")
-    s = s.replace("№", "")
-    s = s.replace("\\", " ")
+    s = s.translate(_NORM_TRANS)
     # Запятую сохраняем: она нужна для разделения "улица, дом"
-    s = re.sub(r"[\.;:\(\)\[\]\{\}]", " ", s)
-    s = re.sub(r"\s*,\s*", ", ", s)
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _PUNCT_RE.sub(" ", s)
+    s = _COMMA_RE.sub(", ", s)
+    s = _WS_RE.sub(" ", s).strip()
     return s
 
 
@@ -203,6 +252,33 @@ _STREET_EQUIV = [
     (r"\bстр\.\b", "стр"),
 ]
 
+# Все правила одной альтернацией: строка сканируется один раз вместо
+# отдельного прохода re.sub на каждое правило. Порядок альтернатив
+# повторяет порядок списка (длинные формы раньше коротких).
+_EQUIV_RE = re.compile("|".join(f"(?P<g{i}>{p})" for i, (p, _) in enumerate(_STREET_EQUIV)))
+_EQUIV_MAP = {f"g{i}": rep for i, (_, rep) in enumerate(_STREET_EQUIV)}
+
+# Быстрый путь для normalize_street_part: правила выше — это замены целых
+# слов, поэтому обычный токен ищется одним lookup'ом вместо прогона
+# альтернации. Ключи — токены после norm_text (точек уже нет).
+_EQUIV_WORD = {
+    "проспект": "пр",
+    "просп": "пр",
+    "пр-кт": "пр",
+    "пр-т": "пр",
+    "пр": "пр",
+    "улица": "ул",
+    "ул": "ул",
+    "набережная": "наб",
+    "наб": "наб",
+    "переулок": "пер",
+    "пер": "пер",
+    "шоссе": "ш",
+    "ш": "ш",
+    "корпус": "к",
+    "строение": "стр",
+}
+
 # Дом: 105, 30а, 94/41, 105-107, 70к1, 70к1с1, 70 к1 стр 1
 _HOUSE_BLOCK_PAT = re.compile(
     r"(?<!\d)(\d{1,4})(?:\s*[-–]\s*(\d{1,4}))?([a-zа-я](?!\d))?"
@@ -211,6 +287,23 @@ _HOUSE_BLOCK_PAT = re.compile(
     re.I,
 )
 
+# Вспомогательные регэкспы разбора адреса (тоже по разу на модуль).
+_DROP_WORDS_RE = re.compile(r"\b(д|дом|к|корп|корпус|с|стр|строение|пом|помещение|оф|офис|лит|литера)\b")
+_NUM_TOKEN_RE = re.compile(r"\d+[a-zа-я]?")
+_NON_ALNUM_RE = re.compile(r"[^a-zа-я0-9]+", re.I)
+_SINGLE_LETTER_RE = re.compile(r"[a-zа-я]")
+# Те же три замены одной альтернацией: строка сканируется один раз вместо
+# трёх проходов с промежуточными копиями. Регистронезависимость нужна
+# только куску с небуквенными символами — она включена локально через (?i:).
+_CLEAN_STREET_RE = re.compile(
+    r"\b(?:д|дом|к|корп|корпус|с|стр|строение|пом|помещение|оф|офис|лит|литера)\b"
+    r"|\d+[a-zа-я]?"
+    r"|(?i:[^a-zа-я0-9]+)"
+)
+_TECH_TOKEN_RE = re.compile(r"(?:к|стр)\d+[a-zа-я]?")
+_COMPACT_CORP_RE = re.compile(r"(\d)\s*к\s*(\d)", re.I)
+_COMPACT_STR_RE = re.compile(r"(\d)\s*с\s*(\d)", re.I)
+
 _STREET_DROP_TOKENS = {
     "д",
     "дом",
@@ -227,15 +320,39 @@ _STREET_DROP_TOKENS = {
     "строение",
 }
 
-_STREET_TYPE_TOKENS = {"ул", "пр", "наб", "пер", "ш"}
+# Канонизация типа улицы одним hash-lookup: покрывает и длинные, и короткие
+# варианты написания, чтобы не зависеть от того, прошёл ли токен через
+# normalize_street_part.
+_STREET_TYPE_CANON = {
+    "проспект": "пр",
+    "просп": "пр",
+    "пр-кт": "пр",
+    "пр-т": "пр",
+    "пр": "пр",
+    "улица": "ул",
+    "ул": "ул",
+    "набережная": "наб",
+    "наб": "наб",
+    "переулок": "пер",
+    "пер": "пер",
+    "шоссе": "ш",
+    "ш": "ш",
+}
 
 
 def normalize_street_part(addr_norm: str) -> str:
-    s = addr_norm
-    for pat, rep in _STREET_EQUIV:
-        s = re.sub(pat, rep, s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+    out = []
+    for tok in addr_norm.split():
+        # Запятая после norm_text всегда прилипает к концу токена.
+        t, tail = (tok[:-1], ",") if tok.endswith(",") else (tok, "")
+        rep = _EQUIV_WORD.get(t)
+        if rep is None:
+            # В чисто буквенном токене \b-границ внутри нет: совпасть могло
+            # только целое слово, а целые слова все в словаре. Токены с
+            # дефисами/слэшами добиваем старой альтернацией.
+            rep = t if t.isalpha() else _EQUIV_RE.sub(lambda m: _EQUIV_MAP[m.lastgroup], t)
+        out.append(rep + tail)
+    return " ".join(out)
 
 
 def _parse_house_from_segment(segment: str, prefer_first: bool):
@@ -271,37 +388,36 @@ def _remove_house_from_segment(segment: str, span: tuple[int, int] | None):
 
 
 def _has_real_street_words(text: str):
-    if not text:
+    # Без единой буквы улице взяться неоткуда — не гоняем регэкспы зря.
+    if not text or not any(c.isalpha() for c in text):
         return False
-    tmp = text
-    tmp = re.sub(r"\b(д|дом|к|корп|корпус|с|стр|строение|пом|помещение|оф|офис|лит|литера)\b", " ", tmp)
-    tmp = re.sub(r"\d+[a-zа-я]?", " ", tmp)
-    # Нормализуем пунктуацию: "-а", "/б" и т.п. превращаем в отдельные токены.
-    tmp = re.sub(r"[^a-zа-я0-9]+", " ", tmp, flags=re.I)
-    tmp = re.sub(r"\s+", " ", tmp).strip()
+    # Вырезаем служебные слова, номера и пунктуацию одним проходом;
+    # "-а", "/б" и т.п. при этом превращаются в отдельные токены.
+    tmp = _CLEAN_STREET_RE.sub(" ", text)
+    tmp = _WS_RE.sub(" ", tmp).strip()
     if not tmp:
         return False
     # После вырезания номера дома иногда остаётся только буква дома: "б".
     # Это не улица, в таком случае улицу нужно брать из предыдущего сегмента.
-    tokens = [t for t in tmp.split() if not re.fullmatch(r"[a-zа-я]", t)]
+    tokens = [t for t in tmp.split() if not _SINGLE_LETTER_RE.fullmatch(t)]
     tmp2 = " ".join(tokens).strip()
     if not tmp2:
         return False
-    return bool(re.search(r"[a-zа-я]", tmp2))
+    return bool(_SINGLE_LETTER_RE.search(tmp2))
 
 
 def _make_street_keys(street_zone: str):
     src = normalize_street_part(street_zone)
-    src = re.sub(r"\s+", " ", src).strip()
+    src = _WS_RE.sub(" ", src).strip()
 
     tokens = []
     for t in src.split():
-        if t in _STREET_TYPE_TOKENS:
+        if t in _STREET_TYPE_CANON:
             continue
         if t in _STREET_DROP_TOKENS:
             continue
         # убираем технические куски типа "к1", "стр2", если вдруг прилипли к street_zone
-        if re.fullmatch(r"(?:к|стр)\d+[a-zа-я]?", t):
+        if _TECH_TOKEN_RE.fullmatch(t):
             continue
         tokens.append(t)
 
@@ -311,6 +427,12 @@ def _make_street_keys(street_zone: str):
     return street_key, street_key_bag
 
 
+AddressComp = namedtuple(
+    "AddressComp",
+    ["raw", "norm", "street_key", "street_key_bag", "house_from", "house_to", "house_letter", "corp", "str"],
+)
+
+
 def extract_components(address: str | None):
     """
     Возвращает структуру:
@@ -327,12 +449,19 @@ def extract_components(address: str | None):
     """
     if not address:
         return None
+    # Одинаковые адреса нормализуются тысячи раз (каждая строка конкурента
+    # против одной и той же базы) — кэшируем разбор по сырой строке.
+    # Наружу отдаём свежий dict, чтобы кэш нельзя было испортить мутацией.
+    return _extract_components_impl(address)._asdict()
+
 
+@functools.lru_cache(maxsize=200_000)
+def _extract_components_impl(address: str) -> AddressComp:
     raw = address
     a = normalize_street_part(norm_text(raw))
     # Разлепляем компактные записи: 70к1с1 -> 70 к1 с1
-    a = re.sub(r"(\d)\s*к\s*(\d)", r"\1 к\2", a, flags=re.I)
-    a = re.sub(r"(\d)\s*с\s*(\d)", r"\1 с\2", a, flags=re.I)
+    a = _COMPACT_CORP_RE.sub(r"\1 к\2", a)
+    a = _COMPACT_STR_RE.sub(r"\1 с\2", a)
 
     parts = [p.strip() for p in a.split(",") if p.strip()]
     house_data = None
@@ -376,17 +505,17 @@ def extract_components(address: str | None):
 
     street_key, street_key_bag = _make_street_keys(street_zone)
 
-    return {
-        "raw": raw,
-        "norm": a,
-        "street_key": street_key,
-        "street_key_bag": street_key_bag,
-        "house_from": house_from,
-        "house_to": house_to,
-        "house_letter": house_letter,
-        "corp": corp,
-        "str": stro,
-    }
+    return AddressComp(
+        raw=raw,
+        norm=a,
+        street_key=street_key,
+        street_key_bag=street_key_bag,
+        house_from=house_from,
+        house_to=house_to,
+        house_letter=house_letter,
+        corp=corp,
+        str=stro,
+    )
 
 
 def houses_overlap(a, b) -> bool:
@@ -421,19 +550,65 @@ def part_relation(comp_a, comp_b, field: str):
 
 
 # ====== ПАРСИНГ КОНКУРЕНТА ======
-def get_title_from_card(card):
-    if card.locator("a.product-item-name").count() > 0:
-        t = clean_text(card.locator("a.product-item-name").first.inner_text())
-        if t:
-            return t
-
-    if card.locator("div.product-item__more").count() > 0:
-        t = clean_text(card.locator("div.product-item__more").first.inner_text())
-        if t:
-            t = t.replace("На карте", "").strip()
-            parts = [p.strip() for p in t.split("\n") if p.strip()]
-            if parts:
-                return parts[0]
+@dataclass(slots=True)
+class CompRow:
+    """
+    Карточка конкурента. slots вместо словаря на строку: поля лежат
+    компактно, без hash-таблицы на каждую из тысяч карточек; в словарь
+    конвертируется только отчёт перед записью CSV.
+    """
+
+    deal_type: str | None = None
+    title: str | None = None
+    address: str | None = None
+    district: str | None = None
+    price_rub: float | int | None = None
+    area_m2: float | int | None = None
+    competitor_url: str | None = None
+    competitor_listing_id: str = ""
+    page_num: int | None = None
+    page_pos: int | None = None
+    position_global: int | None = None
+    pro_mark: str = ""
+    pro_note: str = ""
+
+
+# Каждый locator().count()/inner_text() — отдельный round-trip в браузер;
+# на сотне карточек это тысячи запросов. Снимаем все поля карточек одним
+# evaluate: null в поле значит "элемента нет", пустая строка — "есть, но пустой".
+_KNRU_CARDS_JS = """
+() => Array.from(document.querySelectorAll("div.product-item-container")).map((c) => {
+  const text = (sel) => {
+    const el = c.querySelector(sel);
+    return el ? el.innerText : null;
+  };
+  const a = c.querySelector('a[href^="/catalog/"]');
+  return {
+    href: a ? a.getAttribute("href") : null,
+    title: text("a.product-item-name"),
+    more: text("div.product-item__more"),
+    address_span: text("div.product-item__adress span"),
+    address_div: text("div.product-item__adress"),
+    district_title: text("div.district__title"),
+    district_a: text("a.district"),
+    price: text("div.product-item__price"),
+    area: text("div.square__title"),
+  };
+})
+"""
+
+
+def get_title_from_card(card: dict):
+    t = clean_text(card["title"])
+    if t:
+        return t
+
+    t = clean_text(card["more"])
+    if t:
+        t = t.replace("На карте", "").strip()
+        parts = [p.strip() for p in t.split("\n") if p.strip()]
+        if parts:
+            return parts[0]
     return None
 
 
@@ -472,108 +647,120 @@ async (img) => {
     srcImg = probe;
   }
 
-  const w = 360;
-  const h = Math.max(1, Math.round((h0 / w0) * w));
-  const c = document.createElement("canvas");
-  c.width = w;
-  c.height = h;
-  const ctx = c.getContext("2d", { willReadFrequently: true });
-  try {
-    ctx.drawImage(srcImg, 0, 0, w, h);
-  } catch (e) {
-    return {has: false, reason: "draw_fail"};
-  }
+  const detect = (w) => {
+    const h = Math.max(1, Math.round((h0 / w0) * w));
+    const c = document.createElement("canvas");
+    c.width = w;
+    c.height = h;
+    const ctx = c.getContext("2d", { willReadFrequently: true });
+    try {
+      ctx.drawImage(srcImg, 0, 0, w, h);
+    } catch (e) {
+      return {err: "draw_fail"};
+    }
 
-  const d = ctx.getImageData(0, 0, w, h).data;
-  const x1 = Math.floor(w * 0.22), x2 = Math.floor(w * 0.78);
-  const y1 = Math.floor(h * 0.08), y2 = Math.floor(h * 0.55);
-
-  // Маска "желтовато-зеленого" полупрозрачного круга на синем фоне.
-  const mask = new Uint8Array(w * h);
-  for (let y = y1; y < y2; y++) {
-    for (let x = x1; x < x2; x++) {
-      const i = (y * w + x) * 4;
-      const r = d[i], g = d[i + 1], b = d[i + 2];
-      const v = r + g - 1.25 * b;
-      if (v > 110 && (g - b) > 15 && (r - b) > 5 && g > 120) mask[y * w + x] = 1;
+    const d = ctx.getImageData(0, 0, w, h).data;
+    const x1 = Math.floor(w * 0.22), x2 = Math.floor(w * 0.78);
+    const y1 = Math.floor(h * 0.08), y2 = Math.floor(h * 0.55);
+
+    // Маска "желтовато-зеленого" полупрозрачного круга на синем фоне.
+    // Индекс шагает по строке (+4), без пересчёта (y*w+x)*4 на пиксель.
+    const mask = new Uint8Array(w * h);
+    for (let y = y1; y < y2; y++) {
+      let i = (y * w + x1) * 4;
+      for (let x = x1; x < x2; x++, i += 4) {
+        const r = d[i], g = d[i + 1], b = d[i + 2];
+        const v = r + g - 1.25 * b;
+        if (v > 110 && (g - b) > 15 && (r - b) > 5 && g > 120) mask[y * w + x] = 1;
+      }
     }
-  }
 
-  const seen = new Uint8Array(w * h);
-  const dirs = [[1,0],[-1,0],[0,1],[0,-1]];
-  let best = null;
-
-  for (let y = y1; y < y2; y++) {
-    for (let x = x1; x < x2; x++) {
-      const idx = y * w + x;
-      if (!mask[idx] || seen[idx]) continue;
-
-      let q = [idx], qi = 0;
-      let area = 0, minx = x, maxx = x, miny = y, maxy = y;
-      let sr = 0, sg = 0, sb = 0;
-      seen[idx] = 1;
-
-      while (qi < q.length) {
-        const id = q[qi++];
-        const cx = id % w, cy = (id / w) | 0;
-        area++;
-
-        const ii = (cy * w + cx) * 4;
-        sr += d[ii];
-        sg += d[ii + 1];
-        sb += d[ii + 2];
-
-        if (cx < minx) minx = cx;
-        if (cx > maxx) maxx = cx;
-        if (cy < miny) miny = cy;
-        if (cy > maxy) maxy = cy;
-
-        for (const [dx, dy] of dirs) {
-          const nx = cx + dx, ny = cy + dy;
-          if (nx < x1 || nx >= x2 || ny < y1 || ny >= y2) continue;
-          const nid = ny * w + nx;
-          if (mask[nid] && !seen[nid]) {
-            seen[nid] = 1;
-            q.push(nid);
-          }
+    // Заливка по типизированному стеку: один Int32Array на все компоненты,
+    // без роста JS-массива через push на каждый пиксель.
+    const seen = new Uint8Array(w * h);
+    const stack = new Int32Array(w * h);
+    let best = null;
+
+    for (let y = y1; y < y2; y++) {
+      for (let x = x1; x < x2; x++) {
+        const idx = y * w + x;
+        if (!mask[idx] || seen[idx]) continue;
+
+        let sp = 0;
+        stack[sp++] = idx;
+        seen[idx] = 1;
+        let area = 0, minx = x, maxx = x, miny = y, maxy = y;
+        let sr = 0, sg = 0, sb = 0;
+
+        while (sp > 0) {
+          const id = stack[--sp];
+          const cx = id % w, cy = (id / w) | 0;
+          area++;
+
+          const ii = id * 4;
+          sr += d[ii];
+          sg += d[ii + 1];
+          sb += d[ii + 2];
+
+          if (cx < minx) minx = cx;
+          if (cx > maxx) maxx = cx;
+          if (cy < miny) miny = cy;
+          if (cy > maxy) maxy = cy;
+
+          // Соседи прямым смещением индекса вместо массива направлений.
+          if (cx + 1 < x2 && mask[id + 1] && !seen[id + 1]) { seen[id + 1] = 1; stack[sp++] = id + 1; }
+          if (cx - 1 >= x1 && mask[id - 1] && !seen[id - 1]) { seen[id - 1] = 1; stack[sp++] = id - 1; }
+          if (cy + 1 < y2 && mask[id + w] && !seen[id + w]) { seen[id + w] = 1; stack[sp++] = id + w; }
+          if (cy - 1 >= y1 && mask[id - w] && !seen[id - w]) { seen[id - w] = 1; stack[sp++] = id - w; }
         }
-      }
 
-      const bw = maxx - minx + 1, bh = maxy - miny + 1;
-      const ratio = bw / bh;
-      const fill = area / (bw * bh);
-      const af = area / (w * h);
-      const cxn = (minx + maxx) / 2 / w;
-      const cyn = (miny + maxy) / 2 / h;
-      const mr = sr / area, mg = sg / area, mb = sb / area;
-
-      // Геометрия похожа на круг + типичная позиция watermark + цвет.
-      if (!(af > 0.004 && af < 0.03 && ratio > 0.75 && ratio < 1.35 && fill > 0.50)) continue;
-      if (!(cxn > 0.45 && cxn < 0.73 && cyn > 0.16 && cyn < 0.42)) continue;
-      if (!((mg - mb) > 18 && (mr - mb) > 8)) continue;
-
-      const cand = {area, bw, bh, ratio, fill, af, cxn, cyn, mr, mg, mb};
-      if (!best || cand.area > best.area) best = cand;
+        const bw = maxx - minx + 1, bh = maxy - miny + 1;
+        const ratio = bw / bh;
+        const fill = area / (bw * bh);
+        const af = area / (w * h);
+        const cxn = (minx + maxx) / 2 / w;
+        const cyn = (miny + maxy) / 2 / h;
+        const mr = sr / area, mg = sg / area, mb = sb / area;
+
+        // Геометрия похожа на круг + типичная позиция watermark + цвет.
+        if (!(af > 0.004 && af < 0.03 && ratio > 0.75 && ratio < 1.35 && fill > 0.50)) continue;
+        if (!(cxn > 0.45 && cxn < 0.73 && cyn > 0.16 && cyn < 0.42)) continue;
+        if (!((mg - mb) > 18 && (mr - mb) > 8)) continue;
+
+        const cand = {area, bw, bh, ratio, fill, af, cxn, cyn, mr, mg, mb};
+        if (!best || cand.area > best.area) best = cand;
+      }
     }
-  }
 
-  if (!best) return {has: false, reason: "none"};
-  return {has: true, reason: "component", score: Math.round(best.area), best};
+    return {best};
+  };
+
+  // Грубый проход на 180px — вчетверо меньше пикселей; в типичном случае
+  // (watermark нет) на этом всё и заканчивается. Полные 360px — только
+  // чтобы подтвердить кандидата и вернуть метрики в прежнем масштабе.
+  const coarse = detect(180);
+  if (coarse.err) return {has: false, reason: coarse.err};
+  if (!coarse.best) return {has: false, reason: "none"};
+
+  const fine = detect(360);
+  if (fine.err) return {has: false, reason: fine.err};
+  if (!fine.best) return {has: false, reason: "none"};
+  return {has: true, reason: "component", score: Math.round(fine.best.area), best: fine.best};
 }
 """
 
 
-def detect_pro_watermark(card):
+async def detect_pro_watermark(card):
     """
     Возвращает:
     - pro_mark: yes/no/unknown
     - pro_note: краткая причина/метод
     """
     try:
-        img = card.locator("img").first
-        if img.count() == 0:
+        img = await card.query_selector("img")
+        if img is None:
             return "unknown", "no_img"
-        res = img.evaluate(PRO_DETECT_JS)
+        res = await img.evaluate(PRO_DETECT_JS)
         if isinstance(res, dict) and res.get("has"):
             return "yes", "pixel_heuristic"
         if isinstance(res, dict):
@@ -583,188 +770,249 @@ def detect_pro_watermark(card):
         return "unknown", "eval_error"
 
 
-def parse_one_knru_page(page, page_num: int, rank_start: int, base_url: str):
-    page.wait_for_selector("div.product-item-container", timeout=60_000)
-    cards = page.locator("div.product-item-container")
-    total = cards.count()
+async def parse_one_knru_page(page, page_num: int, rank_start: int, base_url: str):
+    await page.wait_for_selector("div.product-item-container", timeout=60_000)
+    # Текстовые поля — одним evaluate; element handles нужны только
+    # детектору watermark (он рисует картинку в canvas внутри страницы).
+    cards = await page.evaluate(_KNRU_CARDS_JS)
+    handles = await page.query_selector_all("div.product-item-container")
+
+    # Детектор считает пиксели в браузере, Python только ждёт ответа CDP —
+    # пускаем все карточки страницы параллельно; семафор не даёт
+    # забить рендерер одновременными canvas-проходами.
+    sem = asyncio.Semaphore(PRO_DETECT_PARALLEL)
+
+    async def detect(handle):
+        async with sem:
+            return await detect_pro_watermark(handle)
+
+    marks = await asyncio.gather(*(detect(h) for h in handles), return_exceptions=True)
+    marks = [m if isinstance(m, tuple) else ("unknown", "eval_error") for m in marks]
+
     rows = []
     rank = rank_start
 
-    for i in range(total):
-        card = cards.nth(i)
+    for i, card in enumerate(cards):
         rank += 1
 
         # URL
         url = None
-        a_catalog = card.locator('a[href^="/catalog/"]').first
-        if a_catalog.count() > 0:
-            href = a_catalog.get_attribute("href")
-            if href:
-                url = base_url + href
+        if card["href"]:
+            url = base_url + card["href"]
 
         title = get_title_from_card(card)
 
         # Адрес
         address = None
-        if card.locator("div.product-item__adress span").count() > 0:
-            address = clean_text(card.locator("div.product-item__adress span").first.inner_text())
-        elif card.locator("div.product-item__adress").count() > 0:
-            address = clean_text(card.locator("div.product-item__adress").first.inner_text())
+        if card["address_span"] is not None:
+            address = clean_text(card["address_span"])
+        elif card["address_div"] is not None:
+            address = clean_text(card["address_div"])
         if address:
             address = address.replace("На карте", "").strip()
 
         # Район
         district = None
-        if card.locator("div.district__title").count() > 0:
-            district = clean_text(card.locator("div.district__title").first.inner_text())
-        elif card.locator("a.district").count() > 0:
-            district = clean_text(card.locator("a.district").first.inner_text())
+        if card["district_title"] is not None:
+            district = clean_text(card["district_title"])
+        elif card["district_a"] is not None:
+            district = clean_text(card["district_a"])
 
         # Цена
-        price_txt = clean_text(card.locator("div.product-item__price").first.inner_text()) if card.locator("div.product-item__price").count() else None
-        price_rub = extract_first_number(price_txt)
+        price_rub = extract_first_number(clean_text(card["price"]))
 
         # Площадь
-        area_txt = clean_text(card.locator("div.square__title").first.inner_text()) if card.locator("div.square__title").count() else None
-        area_m2 = extract_first_number(area_txt)
+        area_m2 = extract_first_number(clean_text(card["area"]))
         listing_id = extract_listing_id(url)
-        pro_mark, pro_note = detect_pro_watermark(card)
+        pro_mark, pro_note = marks[i] if i < len(marks) else ("unknown", "no_handle")
 
         rows.append(
-            {
-                "deal_type": "sale",  # на knru commercial сейчас это фактически продажа
-                "title": title,
-                "address": address,
-                "district": district,
-                "price_rub": price_rub,
-                "area_m2": area_m2,
-                "competitor_url": url,
-                "competitor_listing_id": listing_id,
-                "page_num": page_num,
-                "page_pos": i + 1,
-                "position_global": rank,
-                "pro_mark": pro_mark,
-                "pro_note": pro_note,
-            }
+            CompRow(
+                deal_type="sale",  # на knru commercial сейчас это фактически продажа
+                title=title,
+                address=address,
+                district=district,
+                price_rub=price_rub,
+                area_m2=area_m2,
+                competitor_url=url,
+                competitor_listing_id=listing_id,
+                page_num=page_num,
+                page_pos=i + 1,
+                position_global=rank,
+                pro_mark=pro_mark,
+                pro_note=pro_note,
+            )
         )
 
     return rows, rank
 
 
-def get_last_page_num_knru(page) -> int:
-    # ищем цифры пагинации
-    nums = []
-    loc = page.locator("a.pagination__el")
-    for i in range(loc.count()):
-        t = clean_text(loc.nth(i).inner_text())
-        if t and t.isdigit():
-            nums.append(int(t))
+async def get_last_page_num_knru(page) -> int:
+    # Все цифры пагинации одним round-trip вместо count()+inner_text()
+    # на каждую ссылку.
+    texts = await page.eval_on_selector_all(
+        "a.pagination__el", "els => els.map(e => (e.textContent || '').trim())"
+    )
+    nums = [int(t) for t in texts if t.isdigit()]
     return max(nums) if nums else 1
 
 
-def parse_all_knru_pages(page, start_url: str, base_url: str):
-    # первая страница
-    rows_all = []
-    rank = 0
-    first_rows, rank = parse_one_knru_page(page, page_num=1, rank_start=rank, base_url=base_url)
-    rows_all.extend(first_rows)
+async def parse_all_knru_pages(context, start_url: str, base_url: str):
+    # первая страница — из неё же узнаём число страниц
+    page = await context.new_page()
+    await page.goto(start_url, wait_until="domcontentloaded", timeout=120_000)
+    first_rows, _ = await parse_one_knru_page(page, page_num=1, rank_start=0, base_url=base_url)
+    last_page = await get_last_page_num_knru(page)
+    await page.close()
 
-    last_page = get_last_page_num_knru(page)
     if last_page <= 1:
-        return rows_all
+        return first_rows
 
-    for n in range(2, last_page + 1):
-        url = f"{start_url}?PAGEN_1={n}"
-        page.goto(url, wait_until="domcontentloaded", timeout=120_000)
-        page_rows, rank = parse_one_knru_page(page, page_num=n, rank_start=rank, base_url=base_url)
-        rows_all.extend(page_rows)
+    # Остальные страницы качаем параллельно отдельными вкладками:
+    # навигация — чистое ожидание сети, семафор держит браузер в рамках.
+    sem = asyncio.Semaphore(MAX_PARALLEL_PAGES)
 
+    async def fetch_page(n: int):
+        async with sem:
+            tab = await context.new_page()
+            try:
+                await tab.goto(f"{start_url}?PAGEN_1={n}", wait_until="domcontentloaded", timeout=120_000)
+                page_rows, _ = await parse_one_knru_page(tab, page_num=n, rank_start=0, base_url=base_url)
+                return page_rows
+            finally:
+                await tab.close()
+
+    tasks = [asyncio.create_task(fetch_page(n)) for n in range(2, last_page + 1)]
+    pages_rows = await asyncio.gather(*tasks)
+
+    # Порядок и сквозная нумерация — как при последовательном обходе.
+    rows_all = list(first_rows)
+    for page_rows in pages_rows:
+        rows_all.extend(page_rows)
+    for rank, row in enumerate(rows_all, 1):
+        row.position_global = rank
     return rows_all
 
 
 # ====== ПАРСИНГ КОНКУРЕНТА (NORDWEST) ======
+_NW_SLUG_RE = re.compile(r"/real-estates/([^/?#]+)")
+_NW_IMG_ID_RE = re.compile(r"/real-estate-grid/(\d+)-")
+
+
 def extract_listing_id_from_slug(url: str | None) -> str:
     if not url:
         return ""
-    m = re.search(r"/real-estates/([^/?#]+)", str(url))
+    m = _NW_SLUG_RE.search(str(url))
     return (m.group(1) if m else "").strip()
 
 
-def extract_nordwest_listing_id(card, url: str | None) -> str:
-    img = card.locator(".header .img img").first
-    if img.count() > 0:
-        src = img.get_attribute("src") or ""
-        m = re.search(r"/real-estate-grid/(\d+)-", src)
+def extract_nordwest_listing_id(img_src: str | None, url: str | None) -> str:
+    if img_src:
+        m = _NW_IMG_ID_RE.search(img_src)
         if m:
             return m.group(1)
     return extract_listing_id_from_slug(url)
 
 
-def parse_one_nordwest_card(card, position_global: int, base_url: str):
-    title = clean_text(card.locator(".name a").first.inner_text()) if card.locator(".name a").count() > 0 else None
+# Те же соображения, что для knru: все поля карточки одним evaluate.
+_NORDWEST_CARDS_JS = """
+() => Array.from(document.querySelectorAll(".real-estates-grid-item")).map((c) => {
+  const text = (sel) => {
+    const el = c.querySelector(sel);
+    return el ? el.innerText : null;
+  };
+  const attr = (sel, name) => {
+    const el = c.querySelector(sel);
+    return el ? el.getAttribute(name) : null;
+  };
+  return {
+    title: text(".name a"),
+    more_href: attr("a.more.button", "href"),
+    name_href: attr(".name a", "href"),
+    address: text(".field-name.icon"),
+    price: text(".info-footer .price .value"),
+    img_src: attr(".header .img img", "src"),
+    fields: Array.from(c.querySelectorAll(".fields .field")).map((f) => {
+      const l = f.querySelector(".label");
+      const v = f.querySelector(".value");
+      return {label: l ? l.innerText : null, value: v ? v.innerText : null};
+    }),
+  };
+})
+"""
+
+
+def parse_one_nordwest_card(card: dict, position_global: int, base_url: str):
+    title = clean_text(card["title"]) if card["title"] is not None else None
 
-    url = None
-    if card.locator("a.more.button").count() > 0:
-        url = card.locator("a.more.button").first.get_attribute("href")
-    if not url and card.locator(".name a").count() > 0:
-        url = card.locator(".name a").first.get_attribute("href")
+    url = card["more_href"]
+    if not url:
+        url = card["name_href"]
     if url and url.startswith("/"):
         url = base_url + url
 
-    address = clean_text(card.locator(".field-name.icon").first.inner_text()) if card.locator(".field-name.icon").count() > 0 else None
+    address = clean_text(card["address"]) if card["address"] is not None else None
 
     # В карточках Nordwest отдельного поля района обычно нет.
     district = None
 
-    price_txt = clean_text(card.locator(".info-footer .price .value").first.inner_text()) if card.locator(".info-footer .price .value").count() else None
-    price_rub = extract_first_number(price_txt)
+    price_rub = extract_first_number(clean_text(card["price"]))
 
     area_m2 = None
-    fields = card.locator(".fields .field")
-    for j in range(fields.count()):
-        f = fields.nth(j)
-        lbl = clean_text(f.locator(".label").first.inner_text()) if f.locator(".label").count() else ""
+    for f in card["fields"]:
+        lbl = clean_text(f["label"]) if f["label"] is not None else ""
         if lbl and "площад" in lbl.lower():
-            val = clean_text(f.locator(".value").first.inner_text()) if f.locator(".value").count() else None
+            val = clean_text(f["value"]) if f["value"] is not None else None
             area_m2 = extract_first_number(val)
             break
 
-    listing_id = extract_nordwest_listing_id(card, url)
+    listing_id = extract_nordwest_listing_id(card["img_src"], url)
+
+    return CompRow(
+        deal_type="sale",
+        title=title,
+        address=address,
+        district=district,
+        price_rub=price_rub,
+        area_m2=area_m2,
+        competitor_url=url,
+        competitor_listing_id=listing_id,
+        page_num=1,
+        page_pos=position_global,
+        position_global=position_global,
+        pro_mark="no",
+        pro_note="nordwest_no_npro_scan",
+    )
 
-    return {
-        "deal_type": "sale",
-        "title": title,
-        "address": address,
-        "district": district,
-        "price_rub": price_rub,
-        "area_m2": area_m2,
-        "competitor_url": url,
-        "competitor_listing_id": listing_id,
-        "page_num": 1,
-        "page_pos": position_global,
-        "position_global": position_global,
-        "pro_mark": "no",
-        "pro_note": "nordwest_no_npro_scan",
-    }
+
+# Число карточек и видимость кнопки "ещё" — одним evaluate вместо трёх
+# отдельных запросов (count кнопки, is_visible, count сетки) на итерацию.
+_NORDWEST_EXPAND_STATE_JS = r"""
+() => {
+  const btn = document.querySelector('a[wire\\:click\\.prevent="load"]');
+  const btnVisible = !!(btn && (btn.offsetWidth || btn.offsetHeight || btn.getClientRects().length));
+  return {count: document.querySelectorAll(".real-estates-grid-item").length, btnVisible};
+}
+"""
 
 
-def expand_nordwest_catalog(page, max_clicks: int = 300):
+async def expand_nordwest_catalog(page, max_clicks: int = 300):
     clicks = 0
     while clicks < max_clicks:
-        btn = page.locator('a[wire\\:click\\.prevent="load"]').first
-        if btn.count() == 0:
-            break
         try:
-            if not btn.is_visible():
-                break
+            state = await page.evaluate(_NORDWEST_EXPAND_STATE_JS)
         except Exception:
             break
+        if not state["btnVisible"]:
+            break
 
-        prev = page.locator(".real-estates-grid-item").count()
+        prev = state["count"]
+        btn = page.locator('a[wire\\:click\\.prevent="load"]').first
         try:
-            btn.scroll_into_view_if_needed(timeout=5_000)
-            btn.click(timeout=15_000)
-            page.wait_for_function(
+            await btn.scroll_into_view_if_needed(timeout=5_000)
+            await btn.click(timeout=15_000)
+            # wait_for_function сам гарантирует, что карточек стало больше.
+            await page.wait_for_function(
                 '(p) => document.querySelectorAll(".real-estates-grid-item").length > p',
                 arg=prev,
                 timeout=30_000,
@@ -774,34 +1022,93 @@ def expand_nordwest_catalog(page, max_clicks: int = 300):
         except Exception:
             break
 
-        cur = page.locator(".real-estates-grid-item").count()
-        if cur <= prev:
-            break
         clicks += 1
 
 
-def parse_all_nordwest_pages(page, start_url: str, base_url: str):
-    page.goto(start_url, wait_until="domcontentloaded", timeout=120_000)
-    page.wait_for_selector(".real-estates-grid-item", timeout=120_000)
+async def parse_all_nordwest_pages(context, start_url: str, base_url: str):
+    page = await context.new_page()
+    await page.goto(start_url, wait_until="domcontentloaded", timeout=120_000)
+    await page.wait_for_selector(".real-estates-grid-item", timeout=120_000)
 
-    expand_nordwest_catalog(page, max_clicks=500)
+    await expand_nordwest_catalog(page, max_clicks=500)
 
-    cards = page.locator(".real-estates-grid-item")
-    total = cards.count()
+    cards = await page.evaluate(_NORDWEST_CARDS_JS)
 
     rows = []
-    for i in range(total):
-        card = cards.nth(i)
+    for i, card in enumerate(cards):
         row = parse_one_nordwest_card(card, position_global=i + 1, base_url=base_url)
         rows.append(row)
+    await page.close()
     return rows
 
 
+# Типы ресурсов, без которых каталог разбирается так же, но грузится
+# заметно быстрее. Картинки блокируем только там, где не нужен детектор
+# watermark (ему нужны пиксели карточек).
+_BLOCKED_RESOURCE_TYPES = {"font", "media", "stylesheet"}
+
+
+async def _make_context(browser, block_images: bool):
+    ctx = await browser.new_context()
+    blocked = _BLOCKED_RESOURCE_TYPES | ({"image"} if block_images else set())
+
+    async def _route(route):
+        if route.request.resource_type in blocked:
+            await route.abort()
+        else:
+            await route.continue_()
+
+    await ctx.route("**/*", _route)
+    return ctx
+
+
+async def _run_browser_competitor(competitor: str, start_url: str, base_url: str, headless: bool):
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=headless)
+        try:
+            # Один контекст на весь обход: параллельные вкладки делят
+            # cookie-джар и HTTP-кэш вместо запуска с чистого листа.
+            if competitor == "knru":
+                ctx = await _make_context(browser, block_images=False)
+                return await parse_all_knru_pages(ctx, start_url=start_url, base_url=base_url)
+            ctx = await _make_context(browser, block_images=True)
+            return await parse_all_nordwest_pages(ctx, start_url=start_url, base_url=base_url)
+        finally:
+            await browser.close()
+
+
+def parse_browser_competitor(competitor: str, start_url: str, base_url: str, headless: bool):
+    """Синхронная обёртка: main() и автотесты не знают про event loop."""
+    return asyncio.run(_run_browser_competitor(competitor, start_url, base_url, headless))
+
+
 def _collect_text_from_node(node):
-    parts = [x.strip() for x in node.xpath(".//text()") if str(x).strip()]
+    # itertext() отдаёт те же текстовые узлы, что .//text(), но без прохода
+    # через XPath-движок на каждую карточку.
+    parts = [x.strip() for x in node.itertext() if x.strip()]
     return " ".join(parts).strip()
 
 
+# Скомпилированные XPath: разбор запроса и построение плана — один раз на
+# модуль, а не на каждую секцию/карточку. Инициализация ленивая, потому что
+# lxml в этом модуле — необязательная зависимость.
+_REST2RENT_XPATH: dict | None = None
+
+
+def _rest2rent_xpath():
+    global _REST2RENT_XPATH
+    if _REST2RENT_XPATH is None:
+        from lxml import etree
+
+        _REST2RENT_XPATH = {
+            "section": etree.XPath("//*[@id=$id]"),
+            "cards": etree.XPath('.//div[contains(@class, "widget-element")]'),
+            "links": etree.XPath('.//a[contains(@href, "rest2rent.yucrm.ru/s/")]/@href'),
+            "texts": etree.XPath('.//div[contains(@class, "widget-text")]'),
+        }
+    return _REST2RENT_XPATH
+
+
 def parse_rest2rent_html(html_text: str, base_url: str, source_note: str):
     try:
         from lxml import html as lxml_html
@@ -813,24 +1120,25 @@ def parse_rest2rent_html(html_text: str, base_url: str, source_note: str):
     except Exception:
         return []
 
+    xp = _rest2rent_xpath()
     rows = []
     rank = 0
 
     for section_id, deal_type in (("аренда", "rent"), ("продажа", "sale")):
-        sec = doc.xpath(f'//*[@id="{section_id}"]')
+        sec = xp["section"](doc, id=section_id)
         if not sec:
             continue
         section_node = sec[0]
-        cards = section_node.xpath('.//div[contains(@class, "widget-element")]')
+        cards = xp["cards"](section_node)
 
         for card in cards:
-            links = card.xpath('.//a[contains(@href, "rest2rent.yucrm.ru/s/")]/@href')
+            links = xp["links"](card)
             if not links:
                 continue
             url = absolute_url(base_url, links[0])
             listing_id = extract_listing_id_from_tail(url, r"/s/([^/?#]+)")
 
-            text_nodes = card.xpath('.//div[contains(@class, "widget-text")]')
+            text_nodes = xp["texts"](card)
             texts = []
             for n in text_nodes:
                 t = _collect_text_from_node(n)
@@ -845,21 +1153,21 @@ def parse_rest2rent_html(html_text: str, base_url: str, source_note: str):
 
             rank += 1
             rows.append(
-                {
-                    "deal_type": deal_type,
-                    "title": address,
-                    "address": address,
-                    "district": None,
-                    "price_rub": price_rub,
-                    "area_m2": area_m2,
-                    "competitor_url": url,
-                    "competitor_listing_id": listing_id,
-                    "page_num": 1,
-                    "page_pos": rank,
-                    "position_global": rank,
-                    "pro_mark": "no",
-                    "pro_note": source_note,
-                }
+                CompRow(
+                    deal_type=deal_type,
+                    title=address,
+                    address=address,
+                    district=None,
+                    price_rub=price_rub,
+                    area_m2=area_m2,
+                    competitor_url=url,
+                    competitor_listing_id=listing_id,
+                    page_num=1,
+                    page_pos=rank,
+                    position_global=rank,
+                    pro_mark="no",
+                    pro_note=source_note,
+                )
             )
 
     return rows
@@ -869,25 +1177,38 @@ def parse_all_rest2rent_pages(start_url: str, base_url: str, rest2rent_html: str
     html_sources = []
     errors = []
 
+    cache_candidates = [Path("/private/tmp/rest2rent_live.html"), Path("/private/tmp/rest2rent.html"), Path("/tmp/rest2rent.html")]
+
+    # Локальный файл, живой запрос и кеши независимы друг от друга —
+    # собираем их параллельно в потоках, чтобы чтение с диска не ждало
+    # сетевой таймаут. Приоритет источников при разборе прежний.
+    async def _gather_sources():
+        coros = []
+        if rest2rent_html:
+            coros.append(asyncio.to_thread(load_text_if_exists, Path(rest2rent_html)))
+        coros.append(asyncio.to_thread(fetch_text, start_url, 90))
+        coros.extend(asyncio.to_thread(load_text_if_exists, p) for p in cache_candidates)
+        return await asyncio.gather(*coros, return_exceptions=True)
+
+    results = asyncio.run(_gather_sources())
+
     if rest2rent_html:
-        local = load_text_if_exists(Path(rest2rent_html))
-        if local:
+        local, results = results[0], results[1:]
+        if isinstance(local, str) and local:
             html_sources.append(("rest2rent_local_html", local))
         else:
             errors.append(f"local_html_not_found:{rest2rent_html}")
 
-    try:
-        live_html = fetch_text(start_url, timeout_sec=90)
+    live_html, cached_list = results[0], results[1:]
+    if isinstance(live_html, httpx.HTTPError):
+        errors.append(f"url_error:{live_html}")
+    elif isinstance(live_html, Exception):
+        errors.append(f"fetch_error:{live_html}")
+    else:
         html_sources.append(("rest2rent_live", live_html))
-    except urllib.error.URLError as e:
-        errors.append(f"url_error:{e}")
-    except Exception as e:
-        errors.append(f"fetch_error:{e}")
 
-    cache_candidates = [Path("/private/tmp/rest2rent_live.html"), Path("/private/tmp/rest2rent.html"), Path("/tmp/rest2rent.html")]
-    for cache_path in cache_candidates:
-        cached = load_text_if_exists(cache_path)
-        if cached:
+    for cache_path, cached in zip(cache_candidates, cached_list):
+        if isinstance(cached, str) and cached:
             html_sources.append((f"rest2rent_cache:{cache_path}", cached))
             break
 
@@ -904,91 +1225,142 @@ def parse_all_rest2rent_pages(start_url: str, base_url: str, rest2rent_html: str
     return []
 
 
-def fetch_text(url: str, timeout_sec: int = 60, extra_headers: dict | None = None):
-    headers = {
-        "User-Agent": (
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/126.0.0.0 Safari/537.36"
-        ),
-        "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-    }
-    if extra_headers:
-        headers.update({k: v for k, v in extra_headers.items() if v})
+DEFAULT_HTTP_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/126.0.0.0 Safari/537.36"
+    ),
+    "Accept-Language": "ru-RU,ru;q=0.9,en-US;q=0.8,en;q=0.7",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+    "Accept-Encoding": "gzip, deflate, br",
+}
 
-    req = urllib.request.Request(
-        url,
-        headers=headers,
-    )
+# Пул соединений на весь модуль: keep-alive вместо нового TCP+TLS на каждый
+# запрос, gzip/br распаковывается самим httpx. Клиент без проверки
+# сертификата создаётся лениво — только если основной упёрся в trust store.
+_HTTP = httpx.Client(timeout=httpx.Timeout(60.0), headers=DEFAULT_HTTP_HEADERS, follow_redirects=True)
+_HTTP_UNVERIFIED: httpx.Client | None = None
+
+
+def _http_unverified() -> httpx.Client:
+    global _HTTP_UNVERIFIED
+    if _HTTP_UNVERIFIED is None:
+        _HTTP_UNVERIFIED = httpx.Client(
+            timeout=httpx.Timeout(60.0), headers=DEFAULT_HTTP_HEADERS, follow_redirects=True, verify=False
+        )
+    return _HTTP_UNVERIFIED
+
+
+def _is_cert_error(e: Exception) -> bool:
+    cause = e
+    while cause is not None:
+        if isinstance(cause, ssl.SSLCertVerificationError):
+            return True
+        cause = cause.__cause__
+    return "CERTIFICATE_VERIFY_FAILED" in str(e)
+
+
+def fetch_text(url: str, timeout_sec: int = 60, extra_headers: dict | None = None):
+    headers = {k: v for k, v in (extra_headers or {}).items() if v}
     try:
-        with urllib.request.urlopen(req, timeout=timeout_sec) as resp:
-            raw = resp.read()
-            enc = resp.headers.get_content_charset() or "utf-8"
-            return raw.decode(enc, errors="ignore")
-    except urllib.error.URLError as e:
+        resp = _HTTP.get(url, headers=headers or None, timeout=timeout_sec)
+        resp.raise_for_status()
+        return resp.text
+    except httpx.TransportError as e:
         # На некоторых macOS-окружениях Python не видит системный trust store.
         # Для парсинга публичных страниц используем fallback без проверки сертификата.
-        reason = getattr(e, "reason", None)
-        if isinstance(reason, ssl.SSLCertVerificationError):
-            ctx = ssl._create_unverified_context()
-            with urllib.request.urlopen(req, timeout=timeout_sec, context=ctx) as resp:
-                raw = resp.read()
-                enc = resp.headers.get_content_charset() or "utf-8"
-                return raw.decode(enc, errors="ignore")
+        if _is_cert_error(e):
+            resp = _http_unverified().get(url, headers=headers or None, timeout=timeout_sec)
+            resp.raise_for_status()
+            return resp.text
         raise
 
 
+# Тайловый обход дёргает build_url_with_bbox на каждый тайл, а меняются в
+# URL только четыре числа. Полный parse_qs/urlencode/urlunparse делаем один
+# раз на стартовый URL и кэшируем шаблон с плейсхолдерами bbox; дальше —
+# один str.format на тайл. Чтение bbox — четырьмя регэкспами по query.
+_BBOX_KEYS = ("leftLongitude", "rightLongitude", "bottomLatitude", "topLatitude")
+_BBOX_PARAM_RES = {
+    "left": re.compile(r"[?&]leftLongitude=([^&#]*)"),
+    "right": re.compile(r"[?&]rightLongitude=([^&#]*)"),
+    "bottom": re.compile(r"[?&]bottomLatitude=([^&#]*)"),
+    "top": re.compile(r"[?&]topLatitude=([^&#]*)"),
+}
+_BBOX_TEMPLATE_CACHE: dict[str, str] = {}
+
+
 def parse_bbox_from_url(url: str):
     try:
-        pu = urllib.parse.urlparse(url)
-        q = urllib.parse.parse_qs(pu.query)
-        left = float(q.get("leftLongitude", [None])[0])
-        right = float(q.get("rightLongitude", [None])[0])
-        bottom = float(q.get("bottomLatitude", [None])[0])
-        top = float(q.get("topLatitude", [None])[0])
+        bbox = {name: float(pat.search(url).group(1)) for name, pat in _BBOX_PARAM_RES.items()}
     except Exception:
         return None
-    if not (left < right and bottom < top):
+    if not (bbox["left"] < bbox["right"] and bbox["bottom"] < bbox["top"]):
         return None
-    return {"left": left, "right": right, "bottom": bottom, "top": top}
+    return bbox
+
+
+def _bbox_url_template(url: str) -> str:
+    tpl = _BBOX_TEMPLATE_CACHE.get(url)
+    if tpl is None:
+        pu = urllib.parse.urlparse(url)
+        pairs = [(k, v) for k, v in urllib.parse.parse_qsl(pu.query) if k not in _BBOX_KEYS]
+        esc = lambda s: s.replace("{", "{{").replace("}", "}}")  # noqa: E731
+        bbox_q = (
+            "leftLongitude={left:.6f}&rightLongitude={right:.6f}"
+            "&bottomLatitude={bottom:.6f}&topLatitude={top:.6f}"
+        )
+        other_q = esc(urllib.parse.urlencode(pairs))
+        new_q = f"{other_q}&{bbox_q}" if other_q else bbox_q
+        tpl = urllib.parse.urlunparse(
+            (esc(pu.scheme), esc(pu.netloc), esc(pu.path), esc(pu.params), new_q, esc(pu.fragment))
+        )
+        _BBOX_TEMPLATE_CACHE[url] = tpl
+    return tpl
 
 
 def build_url_with_bbox(url: str, bbox: dict):
-    pu = urllib.parse.urlparse(url)
-    q = urllib.parse.parse_qs(pu.query)
-    q["leftLongitude"] = [f"{bbox['left']:.6f}"]
-    q["rightLongitude"] = [f"{bbox['right']:.6f}"]
-    q["bottomLatitude"] = [f"{bbox['bottom']:.6f}"]
-    q["topLatitude"] = [f"{bbox['top']:.6f}"]
-    new_q = urllib.parse.urlencode(q, doseq=True)
-    return urllib.parse.urlunparse((pu.scheme, pu.netloc, pu.path, pu.params, new_q, pu.fragment))
-
-
-def split_bbox_4(bbox: dict):
-    mx = (bbox["left"] + bbox["right"]) / 2.0
-    my = (bbox["bottom"] + bbox["top"]) / 2.0
-    return [
-        {"left": bbox["left"], "right": mx, "bottom": bbox["bottom"], "top": my},
-        {"left": mx, "right": bbox["right"], "bottom": bbox["bottom"], "top": my},
-        {"left": bbox["left"], "right": mx, "bottom": my, "top": bbox["top"]},
-        {"left": mx, "right": bbox["right"], "bottom": my, "top": bbox["top"]},
-    ]
+    return _bbox_url_template(url).format(**bbox)
+
+
+def iter_bbox_tiles(bbox: dict, splits: int = 2):
+    """
+    Равномерная сетка splits x splits по bbox: границы каждой оси считает
+    один np.linspace. При splits=2 это те же четыре четверти (нижний ряд,
+    затем верхний), что раньше собирал ручной сплиттер.
+    """
+    lons = np.linspace(bbox["left"], bbox["right"], splits + 1)
+    lats = np.linspace(bbox["bottom"], bbox["top"], splits + 1)
+    for j in range(splits):
+        for i in range(splits):
+            yield {
+                "left": float(lons[i]),
+                "right": float(lons[i + 1]),
+                "bottom": float(lats[j]),
+                "top": float(lats[j + 1]),
+            }
 
 
 def bbox_too_small(bbox: dict, min_lon_span: float = 0.02, min_lat_span: float = 0.02):
     return (bbox["right"] - bbox["left"]) < min_lon_span or (bbox["top"] - bbox["bottom"]) < min_lat_span
 
 
+# Все маркеры капчи одной альтернацией — HTML сканируется один раз.
+_YA_CAPTCHA_RE = re.compile(r"вы не робот|checkcaptcha|smartcaptcha")
+
+
 def is_yandex_captcha_html(html: str):
-    h = (html or "").lower()
-    return ("вы не робот" in h) or ("checkcaptcha" in h) or ("smartcaptcha" in h)
+    return bool(_YA_CAPTCHA_RE.search((html or "").lower()))
+
+
+_YA_STATE_RE = re.compile(r"window\.INITIAL_STATE\s*=\s*(\{.*?\})\s*;\s*</script>", re.S)
 
 
 def extract_yandex_initial_state(html: str):
     if not html:
         return None
-    m = re.search(r"window\.INITIAL_STATE\s*=\s*(\{.*?\})\s*;\s*</script>", html, flags=re.S)
+    m = _YA_STATE_RE.search(html)
     if not m:
         return None
     try:
@@ -1028,21 +1400,21 @@ def parse_yandex_entity(entity: dict, idx: int, base_url: str, source_note: str)
     title = clean_text(entity.get("description")) or address
     listing_id = str(offer_id) if offer_id is not None else extract_listing_id(url)
 
-    return {
-        "deal_type": deal_type,
-        "title": title,
-        "address": address,
-        "district": None,
-        "price_rub": price_rub,
-        "area_m2": area_m2,
-        "competitor_url": url,
-        "competitor_listing_id": listing_id,
-        "page_num": 1,
-        "page_pos": idx,
-        "position_global": idx,
-        "pro_mark": "no",
-        "pro_note": source_note,
-    }
+    return CompRow(
+        deal_type=deal_type,
+        title=title,
+        address=address,
+        district=None,
+        price_rub=price_rub,
+        area_m2=area_m2,
+        competitor_url=url,
+        competitor_listing_id=listing_id,
+        page_num=1,
+        page_pos=idx,
+        position_global=idx,
+        pro_mark="no",
+        pro_note=source_note,
+    )
 
 
 def parse_yandex_entities(state: dict, base_url: str, source_note: str):
@@ -1080,7 +1452,7 @@ def parse_all_yandex_map(
         for attempt in range(retries + 1):
             try:
                 html = fetch_text(url, timeout_sec=90, extra_headers=extra_headers)
-            except urllib.error.URLError as e:
+            except httpx.HTTPError as e:
                 last_err = f"url_error:{e}"
                 time.sleep(0.6 + attempt * 0.5)
                 continue
@@ -1101,8 +1473,8 @@ def parse_all_yandex_map(
 
     def assign_positions(rows):
         for i, row in enumerate(rows, 1):
-            row["position_global"] = i
-            row["page_pos"] = i
+            row.position_global = i
+            row.page_pos = i
         return rows
 
     seen = set()
@@ -1111,7 +1483,7 @@ def parse_all_yandex_map(
 
     def merge_rows(rows):
         for r in rows:
-            key = (r.get("competitor_listing_id") or "").strip() or (r.get("competitor_url") or "").strip()
+            key = (r.competitor_listing_id or "").strip() or (r.competitor_url or "").strip()
             if not key or key in seen:
                 continue
             seen.add(key)
@@ -1131,39 +1503,47 @@ def parse_all_yandex_map(
     bbox = parse_bbox_from_url(start_url)
     tile_stats = {"tiles": 0, "captchas": 0, "fail": 0}
 
-    def walk(b: dict, depth: int):
-        nonlocal tile_stats
-        if tile_stats["tiles"] >= max_tiles:
-            return
-        if depth > max_depth:
-            return
-        if bbox_too_small(b):
-            return
-
-        tile_url = build_url_with_bbox(start_url, b)
-        # Небольшая задержка и джиттер, чтобы не триггерить антибот слишком быстро.
-        time.sleep(max(0.0, delay_ms / 1000.0) + random.uniform(0.0, 0.35))
-        state, status = fetch_state(tile_url, retries=1)
-        tile_stats["tiles"] += 1
-
-        if not state:
-            if status == "captcha":
-                tile_stats["captchas"] += 1
-            else:
-                tile_stats["fail"] += 1
-            return
-
-        rows, total, count = parse_yandex_entities(state, base_url=base_url, source_note=f"yandex_tile_d{depth}")
-        merge_rows(rows)
-
-        # Сплитим только когда явно упираемся в лимит карточек.
-        if depth < max_depth and total and count and total > count and count >= 8:
-            for sub in split_bbox_4(b):
-                walk(sub, depth + 1)
-
+    def fetch_tile(b: dict, depth: int):
+        # Задержка с джиттером, растянутая на число потоков: пул шлёт
+        # столько же запросов в секунду, сколько раньше последовательный
+        # обход, а сетевые RTT при этом перекрываются.
+        time.sleep((max(0.0, delay_ms / 1000.0) + random.uniform(0.0, 0.35)) * YA_TILE_WORKERS)
+        state, status = fetch_state(build_url_with_bbox(start_url, b), retries=1)
+        return b, depth, state, status
+
+    # Тайлы одного уровня независимы — качаем их пулом потоков, уровень за
+    # уровнем (BFS вместо рекурсии). Разбор ответов и merge_rows остаются
+    # в главном потоке, поэтому замков вокруг seen/out_rows не нужно.
     if bbox and root_total and root_len and root_total > root_len and max_depth > 0:
-        for sub in split_bbox_4(bbox):
-            walk(sub, depth=1)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=YA_TILE_WORKERS) as ex:
+            level = [(sub, 1) for sub in iter_bbox_tiles(bbox)]
+            while level:
+                batch = []
+                for b, depth in level:
+                    if tile_stats["tiles"] >= max_tiles:
+                        break
+                    if depth > max_depth or bbox_too_small(b):
+                        continue
+                    tile_stats["tiles"] += 1
+                    batch.append(ex.submit(fetch_tile, b, depth))
+
+                next_level = []
+                for fut in batch:
+                    b, depth, state, status = fut.result()
+                    if not state:
+                        if status == "captcha":
+                            tile_stats["captchas"] += 1
+                        else:
+                            tile_stats["fail"] += 1
+                        continue
+                    rows, total, count = parse_yandex_entities(
+                        state, base_url=base_url, source_note=f"yandex_tile_d{depth}"
+                    )
+                    merge_rows(rows)
+                    # Сплитим только когда явно упираемся в лимит карточек.
+                    if depth < max_depth and total and count and total > count and count >= 8:
+                        next_level.extend((sub, depth + 1) for sub in iter_bbox_tiles(b))
+                level = next_level
 
     # 3) Фоллбеки из локальных HTML, если live дал 0.
     if not out_rows:
@@ -1214,73 +1594,86 @@ def parse_all_yandex_map(
 
 
 # ====== ПАРСИНГ ВАШЕГО XML ======
+_MY_XML_FIELDS = ("deal_type", "status", "address", "square", "price", "crm_url")
+_MY_XML_XPATH: dict | None = None
+
+
+def _my_xml_xpath():
+    # Скомпилированные пути к полям <item>: findtext разбирает путь заново
+    # на каждый вызов, а полей шесть на каждый из тысяч элементов.
+    # Инициализация ленивая — lxml может отсутствовать.
+    global _MY_XML_XPATH
+    if _MY_XML_XPATH is None:
+        from lxml import etree
+
+        _MY_XML_XPATH = {name: etree.XPath(f"string({name})") for name in _MY_XML_FIELDS}
+    return _MY_XML_XPATH
+
+
+def _my_item_from_node(it):
+    ft = it.findtext
+    deal_type = (ft("deal_type") or "").strip()
+    status = (ft("status") or "").strip()
+    address = (ft("address") or "").strip()
+    square = ft("square")
+    price = ft("price")
+    crm_url = (ft("crm_url") or "").strip()
+
+    if not address:
+        return None
+
+    return {
+        "deal_type": deal_type,
+        "status": status,
+        "address": address,
+        "area_m2": extract_first_number(square),
+        "price_rub": extract_first_number(price),
+        "crm_url": crm_url,
+    }
+
+
 def parse_my_xml(xml_path: Path):
     # пробуем lxml (лучше терпит мусор)
     try:
         from lxml import etree
 
-        parser = etree.XMLParser(recover=True, huge_tree=True)
-        tree = etree.parse(str(xml_path), parser)
-        root = tree.getroot()
-
+        xp = _my_xml_xpath()
         items = []
-        for it in root.findall(".//item"):
-            deal_type = (it.findtext("deal_type") or "").strip()
-            status = (it.findtext("status") or "").strip()
-            address = (it.findtext("address") or "").strip()
-            square = it.findtext("square")
-            price = it.findtext("price")
-            crm_url = (it.findtext("crm_url") or "").strip()
-
-            area_m2 = extract_first_number(square)
-            price_rub = extract_first_number(price)
-
-            if not address:
-                continue
-
-            items.append(
-                {
-                    "deal_type": deal_type,
-                    "status": status,
-                    "address": address,
-                    "area_m2": area_m2,
-                    "price_rub": price_rub,
-                    "crm_url": crm_url,
-                }
-            )
+        # iterparse отдаёт <item> по одному: дерево не держится в памяти
+        # целиком, и второй обход findall(".//item") не нужен. Разобранные
+        # элементы сразу вычищаем, чтобы память не росла с файлом.
+        for _, it in etree.iterparse(str(xml_path), tag="item", recover=True, huge_tree=True):
+            address = xp["address"](it).strip()
+            if address:
+                items.append(
+                    {
+                        "deal_type": xp["deal_type"](it).strip(),
+                        "status": xp["status"](it).strip(),
+                        "address": address,
+                        "area_m2": extract_first_number(xp["square"](it)),
+                        "price_rub": extract_first_number(xp["price"](it)),
+                        "crm_url": xp["crm_url"](it).strip(),
+                    }
+                )
+            it.clear()
+            parent = it.getparent()
+            if parent is not None:
+                while it.getprevious() is not None:
+                    del parent[0]
         return items
 
     except Exception:
         # fallback
         import xml.etree.ElementTree as ET
 
-        tree = ET.parse(str(xml_path))
-        root = tree.getroot()
         items = []
-        for it in root.findall(".//item"):
-            deal_type = (it.findtext("deal_type") or "").strip()
-            status = (it.findtext("status") or "").strip()
-            address = (it.findtext("address") or "").strip()
-            square = it.findtext("square")
-            price = it.findtext("price")
-            crm_url = (it.findtext("crm_url") or "").strip()
-
-            area_m2 = extract_first_number(square)
-            price_rub = extract_first_number(price)
-
-            if not address:
+        for _, it in ET.iterparse(str(xml_path)):
+            if it.tag != "item":
                 continue
-
-            items.append(
-                {
-                    "deal_type": deal_type,
-                    "status": status,
-                    "address": address,
-                    "area_m2": area_m2,
-                    "price_rub": price_rub,
-                    "crm_url": crm_url,
-                }
-            )
+            item = _my_item_from_node(it)
+            if item:
+                items.append(item)
+            it.clear()
         return items
 
 
@@ -1290,11 +1683,21 @@ def build_my_index(my_items):
     Индекс по street_key и street_key_bag -> список объектов.
     """
     idx = {}
+    dedup_keys = {}
     for it in my_items:
         comp = extract_components(it["address"])
         if not comp:
             continue
         it["_comp"] = comp
+        # Ключ дедупликации считаем один раз на объект: одинаковые по
+        # (crm_url, адрес, площадь, цена) записи получают один и тот же
+        # маленький int, и _unique_items дальше обходится без сборки и
+        # хеширования кортежа на каждого кандидата.
+        key = (it.get("crm_url"), it.get("address"), it.get("area_m2"), it.get("price_rub"))
+        it["_dk"] = dedup_keys.setdefault(key, len(dedup_keys))
+        # isinstance-проверку цены тоже делаем один раз здесь, а не в
+        # _pick_reference_price на каждый прогон по кандидатам.
+        it["_has_price"] = isinstance(it.get("price_rub"), (int, float))
 
         k1 = comp["street_key"]
         k2 = comp["street_key_bag"]
@@ -1336,7 +1739,7 @@ def _unique_items(items):
     seen = set()
     out = []
     for x in items:
-        key = (x.get("crm_url"), x.get("address"), x.get("area_m2"), x.get("price_rub"))
+        key = x["_dk"]
         if key in seen:
             continue
         seen.add(key)
@@ -1344,23 +1747,37 @@ def _unique_items(items):
     return out
 
 
-def _pick_reference_price(items, comp_deal: str):
+def _pick_reference_price(entries, comp_deal: str):
     """
     Для сравнения цен:
     - в приоритете наш объект того же типа сделки
     - затем fallback на любой тип
+    entries — кортежи (разница площади, индекс, объект); при равной цене
+    выигрывает кандидат ближе по площади, как при старой сортировке.
     Возвращает (price, item, scope)
     """
-    if not items:
+    if not entries:
         return None, None, ""
 
     comp_deal_norm = str(comp_deal or "").strip().lower()
-    same_deal_prices = [
-        x for x in items if x.get("deal_type") == comp_deal_norm and isinstance(x.get("price_rub"), (int, float))
-    ]
-    sale_prices = [x for x in items if x.get("deal_type") == "sale" and isinstance(x.get("price_rub"), (int, float))]
-    rent_prices = [x for x in items if x.get("deal_type") == "rent" and isinstance(x.get("price_rub"), (int, float))]
-    any_prices = [x for x in items if isinstance(x.get("price_rub"), (int, float))]
+    # Один проход вместо четырёх list comprehension по тем же кандидатам;
+    # наличие цены предпосчитано в build_my_index.
+    same_deal_prices = []
+    sale_prices = []
+    rent_prices = []
+    any_prices = []
+    for t in entries:
+        x = t[2]
+        if not x["_has_price"]:
+            continue
+        any_prices.append(t)
+        dt = x.get("deal_type")
+        if dt == comp_deal_norm:
+            same_deal_prices.append(t)
+        if dt == "sale":
+            sale_prices.append(t)
+        elif dt == "rent":
+            rent_prices.append(t)
 
     if same_deal_prices:
         pool = same_deal_prices
@@ -1378,8 +1795,8 @@ def _pick_reference_price(items, comp_deal: str):
     if not pool:
         return None, None, ""
 
-    best_item = min(pool, key=lambda x: float(x["price_rub"]))
-    return float(best_item["price_rub"]), best_item, scope
+    best = min(pool, key=lambda t: (float(t[2]["price_rub"]), t[0], t[1]))
+    return float(best[2]["price_rub"]), best[2], scope
 
 
 def _build_price_alert(comp_price, my_price):
@@ -1410,10 +1827,10 @@ def compare_one(comp_row, my_index):
     """
     Возвращает словарь с результатом сравнения.
     """
-    comp_addr = comp_row.get("address")
-    comp_area = comp_row.get("area_m2")
-    comp_price = comp_row.get("price_rub")
-    comp_deal = str(comp_row.get("deal_type") or "").strip().lower()
+    comp_addr = comp_row.address
+    comp_area = comp_row.area_m2
+    comp_price = comp_row.price_rub
+    comp_deal = str(comp_row.deal_type or "").strip().lower()
 
     comp_comp = extract_components(comp_addr)
     if not comp_comp or (not comp_comp["street_key"] and not comp_comp["street_key_bag"]):
@@ -1453,27 +1870,28 @@ def compare_one(comp_row, my_index):
             "matched_count": 0,
         }
 
-    # корпус/строение
+    # Корпус/строение и разница площадей — одним проходом по кандидатам.
+    # Дальше ветки работают с кортежами (разница, индекс, объект): кортежи
+    # сравниваются лексикографически, так что sort/nsmallest дают тот же
+    # порядок, что старая стабильная сортировка по разнице площади.
+    ca = float(comp_area) if comp_area is not None else None
     same_house = []
     part_mismatch = []
-    for c in candidates:
+    for i, c in enumerate(candidates):
         corp_rel = part_relation(comp_comp, c["_comp"], "corp")
         str_rel = part_relation(comp_comp, c["_comp"], "str")
+        a = c.get("area_m2")
+        d = abs(a - ca) if ca is not None and isinstance(a, (int, float)) else 1e9
         if corp_rel == "mismatch" or str_rel == "mismatch":
-            part_mismatch.append(c)
+            part_mismatch.append((d, i, c))
         else:
-            same_house.append(c)
-
-    def area_diff(c):
-        if comp_area is None or c.get("area_m2") is None:
-            return 10**9
-        return abs(float(comp_area) - float(c["area_m2"]))
+            same_house.append((d, i, c))
 
     # если все отвалились по корпусу/строению
     if not same_house and part_mismatch:
-        all_found = sorted(part_mismatch, key=area_diff)
-        listing = " | ".join(describe_my_item(x) for x in all_found[:12])
-        ref_price, ref_item, scope = _pick_reference_price(all_found, comp_deal)
+        top = heapq.nsmallest(12, part_mismatch)
+        listing = " | ".join(describe_my_item(c) for _, _, c in top)
+        ref_price, ref_item, scope = _pick_reference_price(part_mismatch, comp_deal)
         alert, delta_rub, delta_pct = _build_price_alert(comp_price, ref_price)
         return {
             "result": "Корпус/строение не совпало",
@@ -1484,16 +1902,17 @@ def compare_one(comp_row, my_index):
             "price_alert": alert,
             "price_diff_rub": delta_rub,
             "price_diff_pct": delta_pct,
-            "matched_count": len(all_found),
+            "matched_count": len(part_mismatch),
         }
 
-    same_house_sorted = sorted(same_house, key=area_diff)
-
-    # если нет близких по площади, но дом тот же
-    close = [c for c in same_house_sorted if area_diff(c) <= AREA_TOL]
+    # если нет близких по площади, но дом тот же. Полная сортировка не
+    # нужна: close отбирается линейным проходом, а в листинг идут только
+    # 12 ближайших по площади.
+    close = [t for t in same_house if t[0] <= AREA_TOL]
     if not close:
-        listing = " | ".join(describe_my_item(x) for x in same_house_sorted[:12])
-        ref_price, ref_item, scope = _pick_reference_price(same_house_sorted, comp_deal)
+        top = heapq.nsmallest(12, same_house)
+        listing = " | ".join(describe_my_item(c) for _, _, c in top)
+        ref_price, ref_item, scope = _pick_reference_price(same_house, comp_deal)
         alert, delta_rub, delta_pct = _build_price_alert(comp_price, ref_price)
         return {
             "result": "По адресу есть, но площадь другая",
@@ -1504,16 +1923,16 @@ def compare_one(comp_row, my_index):
             "price_alert": alert,
             "price_diff_rub": delta_rub,
             "price_diff_pct": delta_pct,
-            "matched_count": len(same_house_sorted),
+            "matched_count": len(same_house),
         }
 
     # есть близкие по площади — считаем совпадением адрес+площадь
-    close_listing = " | ".join(describe_my_item(x) for x in close[:12])
+    close_listing = " | ".join(describe_my_item(c) for _, _, c in heapq.nsmallest(12, close))
     ref_price, ref_item, scope = _pick_reference_price(close, comp_deal)
     alert, delta_rub, delta_pct = _build_price_alert(comp_price, ref_price)
 
-    has_sale = any((x.get("deal_type") == "sale") for x in close)
-    has_rent = any((x.get("deal_type") == "rent") for x in close)
+    has_sale = any((x.get("deal_type") == "sale") for _, _, x in close)
+    has_rent = any((x.get("deal_type") == "rent") for _, _, x in close)
 
     if comp_deal == "sale" and (not has_sale) and has_rent:
         return {
@@ -1541,39 +1960,68 @@ def compare_one(comp_row, my_index):
     }
 
 
+# Индекс уезжает в воркеры один раз через initializer, а не в каждой
+# пачке задач: он большой, а compare_one чистая функция без состояния.
+_WORKER_INDEX = None
+
+
+def _init_report_worker(my_index):
+    global _WORKER_INDEX
+    _WORKER_INDEX = my_index
+
+
+def _compare_one_worker(row):
+    return compare_one(row, _WORKER_INDEX)
+
+
 def build_report(comp_rows, my_items):
     my_index = build_my_index(my_items)
 
+    # Сравнение чисто вычислительное и построчно независимое — большие
+    # отчёты раскидываем по процессам, порядок строк сохраняет ex.map.
+    if len(comp_rows) >= REPORT_PARALLEL_MIN_ROWS and (os.cpu_count() or 1) > 1:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=os.cpu_count(), initializer=_init_report_worker, initargs=(my_index,)
+        ) as ex:
+            cmps = list(ex.map(_compare_one_worker, comp_rows, chunksize=64))
+    else:
+        cmps = [compare_one(r, my_index) for r in comp_rows]
+
+    # Цикл крутится на тысячах строк: глобальные хелперы связываем в
+    # локальные имена, а формат площади выносим в функцию — её f-string
+    # компилируется один раз, а не интерпретируется в каждой строке отчёта.
+    fmt_int = format_int_spaces
+    hl = hyperlink
+
+    def _area(x):
+        return f"{float(x):.1f}".rstrip("0").rstrip(".") if isinstance(x, (int, float)) else ""
+
     out = []
-    for r in comp_rows:
-        cmp = compare_one(r, my_index)
-        competitor_price = r.get("price_rub")
-        competitor_price_fmt = format_int_spaces(competitor_price)
-        our_best_price_fmt = format_int_spaces(cmp.get("our_best_price_rub"))
-        price_diff_fmt = format_int_spaces(cmp.get("price_diff_rub"))
+    for r, cmp in zip(comp_rows, cmps):
+        competitor_price_fmt = fmt_int(r.price_rub)
+        our_best_price_fmt = fmt_int(cmp.get("our_best_price_rub"))
+        price_diff_fmt = fmt_int(cmp.get("price_diff_rub"))
         price_diff_pct = cmp.get("price_diff_pct")
 
         out.append(
             {
-                "position_global": r.get("position_global") or "",
-                "page_num": r.get("page_num") or "",
-                "page_pos": r.get("page_pos") or "",
-                "competitor_listing_id": r.get("competitor_listing_id") or "",
-                "deal_type": r.get("deal_type") or "",
-                "district": r.get("district") or "",
-                "address": r.get("address") or "",
-                "area_m2": (
-                    f"{float(r['area_m2']):.1f}".rstrip("0").rstrip(".") if isinstance(r.get("area_m2"), (int, float)) else ""
-                ),
+                "position_global": r.position_global or "",
+                "page_num": r.page_num or "",
+                "page_pos": r.page_pos or "",
+                "competitor_listing_id": r.competitor_listing_id or "",
+                "deal_type": r.deal_type or "",
+                "district": r.district or "",
+                "address": r.address or "",
+                "area_m2": _area(r.area_m2),
                 "price_rub": competitor_price_fmt,
                 "our_best_price_rub": our_best_price_fmt,
                 "price_alert": cmp.get("price_alert") or "",
                 "price_diff_rub": price_diff_fmt,
                 "price_diff_pct": f"{price_diff_pct:.1f}%" if isinstance(price_diff_pct, (int, float)) else "",
                 "price_scope": cmp.get("price_scope") or "",
-                "pro_mark": r.get("pro_mark") or "",
-                "pro_note": r.get("pro_note") or "",
-                "competitor_link": hyperlink(r.get("competitor_url"), "ссылка"),
+                "pro_mark": r.pro_mark or "",
+                "pro_note": r.pro_note or "",
+                "competitor_link": hl(r.competitor_url, "ссылка"),
                 "our_best_link": cmp.get("our_best_link") or "",
                 "result": cmp.get("result") or "",
                 "reason": cmp.get("reason") or "",
@@ -1607,11 +2055,13 @@ def save_csv(path: Path, rows):
         "matched_count",
         "reason",
     ]
-    with open(path, "w", encoding="utf-8", newline="") as f:
-        w = csv.DictWriter(f, fieldnames=fields)
-        w.writeheader()
-        for r in rows:
-            w.writerow(r)
+    # Крупный буфер и writerows: одна C-петля вместо вызова на строку
+    # и syscall'ов записи на каждые 8 КБ. Обычный writer с проекцией по
+    # fields дешевле DictWriter, который сверяет ключи на каждой строке.
+    with open(path, "w", encoding="utf-8", newline="", buffering=1 << 20) as f:
+        w = csv.writer(f)
+        w.writerow(fields)
+        w.writerows([r.get(k, "") for k in fields] for r in rows)
 
 
 def parse_bool_flag(value: str | None, default: bool) -> bool:
@@ -1719,16 +2169,8 @@ def main():
         comp_rows = parse_all_rest2rent_pages(start_url=start_url, base_url=base_url, rest2rent_html=args.rest2rent_html)
         print(f"У конкурента карточек: {len(comp_rows)}")
     else:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=headless)
-            page = browser.new_page()
-            if competitor == "knru":
-                page.goto(start_url, wait_until="domcontentloaded", timeout=120_000)
-                comp_rows = parse_all_knru_pages(page, start_url=start_url, base_url=base_url)
-            else:
-                comp_rows = parse_all_nordwest_pages(page, start_url=start_url, base_url=base_url)
-            print(f"У конкурента карточек: {len(comp_rows)}")
-            browser.close()
+        comp_rows = parse_browser_competitor(competitor, start_url=start_url, base_url=base_url, headless=headless)
+        print(f"У конкурента карточек: {len(comp_rows)}")
 
     print("Сравниваю...")
     report = build_report(comp_rows, my_items)